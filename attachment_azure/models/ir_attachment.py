@@ -5,9 +5,13 @@ import io
 import logging
 import os
 import re
+import threading
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
 
 from odoo import _, api, exceptions, models
+from odoo.tools import split_every
 
 _logger = logging.getLogger(__name__)
 
@@ -28,6 +32,86 @@ except ImportError:
     _logger.debug("Cannot 'import azure-identity'.")
 
 
+AZURE_SAS_TOKEN_TTL = timedelta(hours=1)
+# a client using a SAS token is renewed before the expiry of its token
+AZURE_SAS_TOKEN_RENEWAL = 300
+AZURE_CONTAINER_CHECK_TTL = int(
+    os.environ.get("AZURE_STORAGE_CONTAINER_CHECK_TTL", 300)
+)
+MB = 1024 * 1024
+AZURE_MAX_CONCURRENCY = int(os.environ.get("AZURE_STORAGE_MAX_CONCURRENCY", 4))
+# sizes of the blocks of the uploads and of the chunks of the downloads
+AZURE_CLIENT_OPTIONS = {
+    "max_block_size": int(os.environ.get("AZURE_STORAGE_MAX_BLOCK_SIZE", 4)) * MB,
+    "max_single_put_size": (
+        int(os.environ.get("AZURE_STORAGE_MAX_SINGLE_PUT_SIZE", 64)) * MB
+    ),
+    "max_chunk_get_size": (
+        int(os.environ.get("AZURE_STORAGE_MAX_CHUNK_GET_SIZE", 4)) * MB
+    ),
+}
+
+
+class AzureClientStore(object):
+    """Keep in memory the Azure clients and the containers known to exist
+
+    Building a ``BlobServiceClient`` creates a new HTTP pipeline, hence new
+    connections, and checking the existence of the container costs a
+    request. Both were done for every read, write or delete of an
+    attachment.
+
+    The clients are kept per configuration. A client using a SAS token is
+    renewed ``AZURE_SAS_TOKEN_RENEWAL`` seconds before the token expires.
+    With AAD, the same ``DefaultAzureCredential`` is used by all the
+    clients, so it keeps its access token until it expires.
+
+    The existence of a container is checked again after
+    ``AZURE_CONTAINER_CHECK_TTL`` seconds.
+
+    The store is emptied in a forked process (prefork workers) as the
+    connections of the parent process must not be shared.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._containers = {}
+        self._credential = None
+
+    def clear(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._containers = {}
+        self._credential = None
+
+    def get_credential(self):
+        if self._credential is None:
+            with self._lock:
+                if self._credential is None:
+                    self._credential = DefaultAzureCredential()
+        return self._credential
+
+    def get_client(self, key):
+        client, expire_at = self._clients.get(key, (None, None))
+        if client and (expire_at is None or time.time() < expire_at):
+            return client
+        return None
+
+    def set_client(self, key, client, expire_at=None):
+        self._clients[key] = (client, expire_at)
+
+    def is_container_checked(self, account_url, container_name):
+        checked_at = self._containers.get((account_url, container_name))
+        return bool(checked_at and time.time() - checked_at < AZURE_CONTAINER_CHECK_TTL)
+
+    def set_container_checked(self, account_url, container_name):
+        self._containers[(account_url, container_name)] = time.time()
+
+
+azure_client_store = AzureClientStore()
+os.register_at_fork(after_in_child=azure_client_store.clear)
+
+
 class IrAttachment(models.Model):
     _inherit = "ir.attachment"
 
@@ -47,6 +131,9 @@ class IrAttachment(models.Model):
         or if you want to use AAD (pod identity), set it to 1 or 0
         * ``AZURE_STORAGE_USE_AAD``
 
+        The client is shared by all the calls using the same configuration,
+        see ``AzureClientStore``.
+
         """
         connect_str = os.environ.get("AZURE_STORAGE_CONNECTION_STRING")
         account_name = os.environ.get("AZURE_STORAGE_ACCOUNT_NAME")
@@ -70,16 +157,22 @@ class IrAttachment(models.Model):
                 "* AZURE_STORAGE_USE_AAD\n"
             )
             raise exceptions.UserError(msg)
-        blob_service_client = None
+        key = (connect_str, account_name, account_url, account_key, account_use_aad)
+        blob_service_client = azure_client_store.get_client(key)
+        if blob_service_client:
+            return blob_service_client
+        expire_at = None
         if account_use_aad:
-            token_credential = DefaultAzureCredential()
+            token_credential = azure_client_store.get_credential()
             blob_service_client = BlobServiceClient(
-                account_url=account_url, credential=token_credential
+                account_url=account_url,
+                credential=token_credential,
+                **AZURE_CLIENT_OPTIONS,
             )
         elif connect_str:
             try:
                 blob_service_client = BlobServiceClient.from_connection_string(
-                    connect_str
+                    connect_str, **AZURE_CLIENT_OPTIONS
                 )
             except HttpResponseError as error:
                 _logger.exception(
@@ -89,16 +182,23 @@ class IrAttachment(models.Model):
                 raise exceptions.UserError(str(error)) from None
         else:
             try:
+                expiry = datetime.utcnow() + AZURE_SAS_TOKEN_TTL
                 sas_token = generate_account_sas(
                     account_name=account_name,
                     account_key=account_key,
                     resource_types=ResourceTypes(container=True, object=True),
                     permission=AccountSasPermissions(read=True, write=True),
-                    expiry=datetime.utcnow() + timedelta(hours=1),
+                    expiry=expiry,
+                )
+                expire_at = (
+                    time.time()
+                    + AZURE_SAS_TOKEN_TTL.total_seconds()
+                    - AZURE_SAS_TOKEN_RENEWAL
                 )
                 blob_service_client = BlobServiceClient(
                     account_url=account_url,
                     credential=sas_token,
+                    **AZURE_CLIENT_OPTIONS,
                 )
             except HttpResponseError as error:
                 _logger.exception(
@@ -106,6 +206,7 @@ class IrAttachment(models.Model):
                     "Access Signature (SAS)"
                 )
                 raise exceptions.UserError(str(error)) from None
+        azure_client_store.set_client(key, blob_service_client, expire_at)
         return blob_service_client
 
     @api.model
@@ -133,13 +234,22 @@ class IrAttachment(models.Model):
             )
             return False
         container_client = blob_service_client.get_container_client(container_name)
+        account_url = blob_service_client.url
+        if azure_client_store.is_container_checked(account_url, container_name):
+            return container_client
         if not container_client.exists():
             try:
                 # Create the container
                 container_client.create_container()
+            except ResourceExistsError:
+                _logger.debug(
+                    "Azure container '%s' created by another worker in the meantime",
+                    container_name,
+                )
             except HttpResponseError as error:
                 _logger.exception("Error during the creation of the Azure container")
                 raise exceptions.UserError(str(error)) from None
+        azure_client_store.set_container_checked(account_url, container_name)
         return container_client
 
     @api.model
@@ -156,7 +266,9 @@ class IrAttachment(models.Model):
                 return ""
             try:
                 blob_client = container_client.get_blob_client(key)
-                read = blob_client.download_blob().readall()
+                read = blob_client.download_blob(
+                    max_concurrency=AZURE_MAX_CONCURRENCY
+                ).readall()
             except HttpResponseError:
                 read = ""
                 _logger.info("Attachment '%s' missing on object storage", fname)
@@ -164,18 +276,72 @@ class IrAttachment(models.Model):
         else:
             return super(IrAttachment, self)._store_file_read(fname, bin_size)
 
+    @api.model
+    def _store_file_stream(self, fname, start=0, end=None):
+        """Yield the content of the blob by chunks
+
+        Only the requested range of bytes is downloaded and a chunk of
+        ``AZURE_STORAGE_MAX_CHUNK_GET_SIZE`` at a time is kept in memory.
+        """
+        if not fname.startswith("azure://"):
+            yield from super(IrAttachment, self)._store_file_stream(
+                fname, start=start, end=end
+            )
+            return
+        key = fname.replace("azure://", "", 1).lower()
+        if "/" in key:
+            container_name, key = key.split("/", 1)
+        else:
+            container_name = None
+        container_client = self._get_azure_container(container_name)
+        if not container_client:
+            return
+        length = None if end is None else end - start + 1
+        try:
+            downloader = container_client.get_blob_client(key).download_blob(
+                offset=start, length=length
+            )
+            yield from downloader.chunks()
+        except HttpResponseError:
+            _logger.info("Attachment '%s' missing on object storage", fname)
+
+    @api.model
+    def _store_file_exists(self, key):
+        location = self.env.context.get("storage_location") or self._storage()
+        if location == "azure":
+            container_client = self._get_azure_container()
+            if not container_client:
+                return False
+            try:
+                exists = container_client.get_blob_client(key.lower()).exists()
+            except HttpResponseError:
+                return False
+            if not exists:
+                return False
+            return "azure://%s/%s" % (container_client.container_name, key)
+        return super(IrAttachment, self)._store_file_exists(key)
+
     @api.model
     def _store_file_write(self, key, bin_data):
         location = self.env.context.get("storage_location") or self._storage()
         if location == "azure":
             container_client = self._get_azure_container()
             filename = "azure://%s/%s" % (container_client.container_name, key)
-            with io.BytesIO() as file:
+            if not isinstance(bin_data, bytes):
+                bin_data = bytes(bin_data)
+            # the BytesIO shares the buffer of the bytes, the content is not
+            # copied
+            with io.BytesIO(bin_data) as file:
                 blob_client = container_client.get_blob_client(key.lower())
-                file.write(bin_data)
-                file.seek(0)
                 try:
-                    blob_client.upload_blob(file, blob_type="BlockBlob")
+                    # the blobs above max_single_put_size are sent by blocks,
+                    # concurrently
+                    blob_client.upload_blob(
+                        file,
+                        blob_type="BlockBlob",
+                        length=len(bin_data),
+                        max_concurrency=AZURE_MAX_CONCURRENCY,
+                    )
                 except ResourceExistsError:
                     _logger.exception(
                         "Trying to re create an existing resource %s" % filename
@@ -216,3 +382,58 @@ class IrAttachment(models.Model):
                 _logger.exception("Error during deletion of the file %s" % fname)
         else:
             super(IrAttachment, self)._store_file_delete(fname)
+
+    @api.model
+    def _store_list_files(self, storage):
+        if storage == "azure":
+            container_client = self._get_azure_container()
+            if not container_client:
+                raise exceptions.UserError(_("Could not access the Azure container"))
+            prefix = "azure://%s/" % (container_client.container_name,)
+            # the blobs are listed in binary order, by pages of 5000
+            files = (
+                (prefix + blob.name, blob.size)
+                for blob in container_client.list_blobs()
+            )
+            return prefix, files
+        return super(IrAttachment, self)._store_list_files(storage)
+
+    @api.model
+    def _store_file_delete_many(self, fnames):
+        """Delete the files of the Azure containers with batch requests
+
+        A batch request deletes up to 256 blobs.
+        """
+        keys_by_container = defaultdict(list)
+        others = []
+        for fname in fnames:
+            if fname.startswith("azure://"):
+                key = fname.replace("azure://", "", 1).lower()
+                if "/" in key:
+                    container_name, key = key.split("/", 1)
+                else:
+                    container_name = None
+                keys_by_container[container_name].append(key)
+            else:
+                others.append(fname)
+        for container_name, keys in keys_by_container.items():
+            container_client = self._get_azure_container(container_name)
+            if not container_client:
+                continue
+            for chunk in split_every(256, keys):
+                try:
+                    responses = container_client.delete_blobs(
+                        *chunk, raise_on_any_failure=False
+                    )
+                except HttpResponseError:
+                    _logger.exception("Error during deletion of files on Azure")
+                    continue
+                for key, response in zip(chunk, responses):
+                    if response.status_code not in (202, 404):
+                        _logger.error(
+                            "Error during deletion of the file %s: %s",
+                            key,
+                            response.reason,
+                        )
+                _logger.info("%d files deleted on the object storage", len(chunk))
+        return super(IrAttachment, self)._store_file_delete_many(others)
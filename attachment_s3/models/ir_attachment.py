@@ -5,9 +5,13 @@
 import io
 import logging
 import os
+import threading
+import time
+from collections import defaultdict
 from urllib.parse import urlsplit
 
 from odoo import _, api, exceptions, models
+from odoo.tools import split_every
 
 from ..s3uri import S3Uri
 
@@ -15,14 +19,90 @@ _logger = logging.getLogger(__name__)
 
 try:
     import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
     from botocore.exceptions import ClientError, EndpointConnectionError
 except ImportError:
     boto3 = None  # noqa
+    TransferConfig = None  # noqa
+    Config = None  # noqa
     ClientError = None  # noqa
     EndpointConnectionError = None  # noqa
     _logger.debug("Cannot 'import boto3'.")
 
 
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", 50))
+S3_BUCKET_CHECK_TTL = int(os.environ.get("AWS_BUCKET_CHECK_TTL", 300))
+S3_STREAM_CHUNK_SIZE = 1024 * 1024
+S3_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", 5))
+MB = 1024 * 1024
+S3_MULTIPART_THRESHOLD = int(os.environ.get("AWS_MULTIPART_THRESHOLD", 16)) * MB
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get("AWS_MULTIPART_CHUNKSIZE", 16)) * MB
+S3_MAX_CONCURRENCY = int(os.environ.get("AWS_MAX_CONCURRENCY", 10))
+
+
+class S3ClientStore(object):
+    """Keep in memory the S3 clients and the buckets known to exist
+
+    Building a boto3 client is expensive (it loads the service model and
+    creates a new connection pool), and checking the existence of the
+    bucket costs a HEAD request. Both were done for every read, write or
+    delete of an attachment.
+
+    The clients are kept per connection parameters. Unlike the boto3
+    resources, the clients are thread-safe: a client is shared by the
+    threads of a worker, with its urllib3 connection pool.
+
+    The existence of a bucket is checked again after
+    ``S3_BUCKET_CHECK_TTL`` seconds.
+
+    The store is emptied in a forked process (prefork workers) as the
+    connections of the parent process must not be shared.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._buckets = {}
+
+    def clear(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._buckets = {}
+
+    def _get_key(self, params):
+        return tuple(sorted(params.items()))
+
+    def get_client(self, params):
+        key = self._get_key(params)
+        client = self._clients.get(key)
+        if not client:
+            with self._lock:
+                client = self._clients.get(key)
+                if not client:
+                    # the requests, including each part of a multipart
+                    # upload, are retried on transient errors
+                    config = Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+                    )
+                    session = boto3.session.Session()
+                    client = session.client("s3", config=config, **params)
+                    self._clients[key] = client
+        return client
+
+    def is_bucket_checked(self, params, bucket_name):
+        checked_at = self._buckets.get((self._get_key(params), bucket_name))
+        return bool(checked_at and time.time() - checked_at < S3_BUCKET_CHECK_TTL)
+
+    def set_bucket_checked(self, params, bucket_name):
+        self._buckets[(self._get_key(params), bucket_name)] = time.time()
+
+
+s3_client_store = S3ClientStore()
+os.register_at_fork(after_in_child=s3_client_store.clear)
+
+
 class IrAttachment(models.Model):
     _inherit = "ir.attachment"
 
@@ -31,7 +111,38 @@ class IrAttachment(models.Model):
 
     @api.model
     def _get_s3_bucket(self, name=None):
-        """Connect to S3 and return the bucket
+        """Return the boto3 resource of the bucket
+
+        Kept for compatibility, the addon uses ``_get_s3_client``: the
+        resource is built for each call as the boto3 resources are not
+        thread-safe.
+        """
+        __, bucket_name = self._get_s3_client(name=name)
+        params = self._get_s3_connection_params()
+        return boto3.session.Session().resource("s3", **params).Bucket(bucket_name)
+
+    @api.model
+    def _get_s3_connection_params(self):
+        host = os.environ.get("AWS_HOST")
+
+        # Ensure host is prefixed with a scheme (use https as default)
+        if host and not urlsplit(host).scheme:
+            host = "https://%s" % host
+
+        params = {
+            "aws_access_key_id": os.environ.get("AWS_ACCESS_KEY_ID"),
+            "aws_secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY"),
+        }
+        if host:
+            params["endpoint_url"] = host
+        region_name = os.environ.get("AWS_REGION")
+        if region_name:
+            params["region_name"] = region_name
+        return params
+
+    @api.model
+    def _get_s3_client(self, name=None):
+        """Connect to S3 and return the client and the name of the bucket
 
         The following environment variables can be set:
         * ``AWS_HOST``
@@ -43,28 +154,19 @@ class IrAttachment(models.Model):
         If a name is provided, we'll read this bucket, otherwise, the bucket
         from the environment variable ``AWS_BUCKETNAME`` will be read.
 
-        """
-        host = os.environ.get("AWS_HOST")
-
-        # Ensure host is prefixed with a scheme (use https as default)
-        if host and not urlsplit(host).scheme:
-            host = "https://%s" % host
+        The S3 client is shared by all the calls using the same parameters
+        and the bucket existence is verified once every
+        ``AWS_BUCKET_CHECK_TTL`` seconds, see ``S3ClientStore``.
 
+        """
         region_name = os.environ.get("AWS_REGION")
-        access_key = os.environ.get("AWS_ACCESS_KEY_ID")
-        secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
         bucket_name = name or os.environ.get("AWS_BUCKETNAME")
         # replaces {db} by the database name to handle multi-tenancy
         bucket_name = bucket_name.format(db=self.env.cr.dbname)
 
-        params = {
-            "aws_access_key_id": access_key,
-            "aws_secret_access_key": secret_key,
-        }
-        if host:
-            params["endpoint_url"] = host
-        if region_name:
-            params["region_name"] = region_name
+        params = self._get_s3_connection_params()
+        access_key = params["aws_access_key_id"]
+        secret_key = params["aws_secret_access_key"]
         if not (access_key and secret_key and bucket_name):
             msg = _(
                 "If you want to read from the %(bucket_name)s S3 bucket, the following "
@@ -79,12 +181,12 @@ class IrAttachment(models.Model):
             ).format(bucket_name=bucket_name)
 
             raise exceptions.UserError(msg)
-        # try:
-        s3 = boto3.resource("s3", **params)
-        bucket = s3.Bucket(bucket_name)
+        client = s3_client_store.get_client(params)
+        if s3_client_store.is_bucket_checked(params, bucket_name):
+            return client, bucket_name
         exists = True
         try:
-            s3.meta.client.head_bucket(Bucket=bucket_name)
+            client.head_bucket(Bucket=bucket_name)
         except ClientError as e:
             # If a client error is thrown, then check that it was a 404 error.
             # If it was a 404 error, then the bucket does not exist.
@@ -98,51 +200,113 @@ class IrAttachment(models.Model):
 
         if not exists:
             if not region_name:
-                bucket = s3.create_bucket(Bucket=bucket_name)
+                client.create_bucket(Bucket=bucket_name)
             else:
-                bucket = s3.create_bucket(
+                client.create_bucket(
                     Bucket=bucket_name,
                     CreateBucketConfiguration={"LocationConstraint": region_name},
                 )
-        return bucket
+        s3_client_store.set_bucket_checked(params, bucket_name)
+        return client, bucket_name
 
     @api.model
-    def _store_file_read(self, fname):
-        if fname.startswith("s3://"):
-            s3uri = S3Uri(fname)
-            try:
-                bucket = self._get_s3_bucket(name=s3uri.bucket())
-            except exceptions.UserError:
+    def _get_s3_object(self, fname, start=0, end=None):
+        """Send a single GET request for the object and return its response
+
+        ``start`` and ``end`` (inclusive) can be given to read only a
+        range of bytes of the object.
+
+        Return None when the object could not be read: the body of the
+        response has to be read by the caller.
+        """
+        s3uri = S3Uri(fname)
+        try:
+            client, bucket_name = self._get_s3_client(name=s3uri.bucket())
+        except exceptions.UserError:
+            _logger.exception(
+                "error reading attachment '%s' from object storage", fname
+            )
+            return None
+        params = {"Bucket": bucket_name, "Key": s3uri.item()}
+        if start or end is not None:
+            params["Range"] = "bytes=%d-%s" % (start, "" if end is None else end)
+        try:
+            return client.get_object(**params)
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                _logger.info("attachment '%s' missing on object storage", fname)
+            else:
                 _logger.exception(
                     "error reading attachment '%s' from object storage", fname
                 )
+            return None
+
+    @api.model
+    def _store_file_read(self, fname):
+        if fname.startswith("s3://"):
+            response = self._get_s3_object(fname)
+            if response is None:
                 return ""
+            body = response["Body"]
             try:
-                key = s3uri.item()
-                bucket.meta.client.head_object(Bucket=bucket.name, Key=key)
-                with io.BytesIO() as res:
-                    bucket.download_fileobj(key, res)
-                    res.seek(0)
-                    read = res.read()
-            except ClientError:
-                read = ""
-                _logger.info("attachment '%s' missing on object storage", fname)
-            return read
+                return body.read()
+            finally:
+                body.close()
         else:
             return super()._store_file_read(fname)
 
+    @api.model
+    def _store_file_stream(self, fname, start=0, end=None):
+        """Yield the content of the object by chunks
+
+        Only the requested range of bytes is downloaded and a chunk at a
+        time is kept in memory.
+        """
+        if not fname.startswith("s3://"):
+            yield from super()._store_file_stream(fname, start=start, end=end)
+            return
+        response = self._get_s3_object(fname, start=start, end=end)
+        if response is None:
+            return
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size=S3_STREAM_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    @api.model
+    def _store_file_exists(self, key):
+        location = self.env.context.get("storage_location") or self._storage()
+        if location == "s3":
+            client, bucket_name = self._get_s3_client()
+            try:
+                client.head_object(Bucket=bucket_name, Key=key)
+            except ClientError:
+                return False
+            return "s3://%s/%s" % (bucket_name, key)
+        return super()._store_file_exists(key)
+
     @api.model
     def _store_file_write(self, key, bin_data):
         location = self.env.context.get("storage_location") or self._storage()
         if location == "s3":
-            bucket = self._get_s3_bucket()
-            obj = bucket.Object(key=key)
-            with io.BytesIO() as file:
-                file.write(bin_data)
-                file.seek(0)
-                filename = "s3://%s/%s" % (bucket.name, key)
+            client, bucket_name = self._get_s3_client()
+            filename = "s3://%s/%s" % (bucket_name, key)
+            # files above the threshold are sent by parts, concurrently
+            transfer_config = TransferConfig(
+                multipart_threshold=S3_MULTIPART_THRESHOLD,
+                multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+                max_concurrency=S3_MAX_CONCURRENCY,
+            )
+            if not isinstance(bin_data, bytes):
+                bin_data = bytes(bin_data)
+            # a BytesIO shares the buffer of the bytes it is initialized
+            # with (until it is modified), the content is not copied
+            with io.BytesIO(bin_data) as file:
                 try:
-                    obj.upload_fileobj(file)
+                    client.upload_fileobj(
+                        file, bucket_name, key, Config=transfer_config
+                    )
                 except ClientError as error:
                     # log verbose error from s3, return short message for user
                     _logger.exception("Error during storage of the file %s" % filename)
@@ -163,11 +327,10 @@ class IrAttachment(models.Model):
             # delete the file only if it is on the current configured bucket
             # otherwise, we might delete files used on a different environment
             if bucket_name == os.environ.get("AWS_BUCKETNAME"):
-                bucket = self._get_s3_bucket()
-                obj = bucket.Object(key=item_name)
+                client, bucket_name = self._get_s3_client()
                 try:
-                    bucket.meta.client.head_object(Bucket=bucket.name, Key=item_name)
-                    obj.delete()
+                    client.head_object(Bucket=bucket_name, Key=item_name)
+                    client.delete_object(Bucket=bucket_name, Key=item_name)
                     _logger.info("file %s deleted on the object storage" % (fname,))
                 except ClientError:
                     # log verbose error from s3, return short message for
@@ -175,3 +338,57 @@ class IrAttachment(models.Model):
                     _logger.exception("Error during deletion of the file %s" % fname)
         else:
             return super()._store_file_delete(fname)
+
+    @api.model
+    def _store_list_files(self, storage):
+        if storage == "s3":
+            client, bucket_name = self._get_s3_client()
+            files = self._s3_list_files(client, bucket_name)
+            return "s3://%s/" % (bucket_name,), files
+        return super()._store_list_files(storage)
+
+    def _s3_list_files(self, client, bucket_name):
+        # ListObjectsV2 returns the keys in binary order, 1000 per page
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name):
+            for obj in page.get("Contents", []):
+                yield "s3://%s/%s" % (bucket_name, obj["Key"]), obj["Size"]
+
+    @api.model
+    def _store_file_delete_many(self, fnames):
+        """Delete the files of the S3 bucket with DeleteObjects requests
+
+        As in ``_store_file_delete``, only the files of the configured
+        bucket are deleted. A request deletes up to 1000 keys.
+        """
+        keys_by_bucket = defaultdict(list)
+        others = []
+        for fname in fnames:
+            if fname.startswith("s3://"):
+                s3uri = S3Uri(fname)
+                keys_by_bucket[s3uri.bucket()].append(s3uri.item())
+            else:
+                others.append(fname)
+        keys = keys_by_bucket.get(os.environ.get("AWS_BUCKETNAME"))
+        if keys:
+            client, bucket_name = self._get_s3_client()
+            for chunk in split_every(1000, keys):
+                try:
+                    response = client.delete_objects(
+                        Bucket=bucket_name,
+                        Delete={
+                            "Objects": [{"Key": key} for key in chunk],
+                            "Quiet": True,
+                        },
+                    )
+                except ClientError:
+                    _logger.exception("Error during deletion of files on S3")
+                    continue
+                for error in response.get("Errors", []):
+                    _logger.error(
+                        "Error during deletion of the file %s: %s",
+                        error.get("Key"),
+                        error.get("Message"),
+                    )
+                _logger.info("%d files deleted on the object storage", len(chunk))
+        return super()._store_file_delete_many(others)
@@ -2,10 +2,17 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 
+import io
+import json
 import logging
+import math
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
 from odoo import _, api, exceptions, models
+from odoo.tools import split_every
 
 from ..swift_uri import SwiftUri
 
@@ -24,6 +31,12 @@ except ImportError:
 
 
 SWIFT_TIMEOUT = 15
+MB = 1024 * 1024
+# objects larger than a segment are uploaded as Static Large Objects
+SWIFT_SEGMENT_SIZE = int(os.environ.get("SWIFT_SEGMENT_SIZE", 1024)) * MB
+SWIFT_SEGMENT_WORKERS = int(os.environ.get("SWIFT_SEGMENT_WORKERS", 4))
+SWIFT_STREAM_CHUNK_SIZE = 1024 * 1024
+SWIFT_LIST_LIMIT = 10000
 
 
 class SwiftSessionStore(object):
@@ -74,6 +87,89 @@ class SwiftSessionStore(object):
 swift_session_store = SwiftSessionStore()
 
 
+class SwiftConnectionStore(object):
+    """Keep in memory the Swift connections and the existing containers
+
+    A ``swiftclient`` connection keeps its HTTP connection open, but it
+    must not be shared between threads, so a connection is kept per
+    thread and per connection parameters.
+
+    The containers created or found by a worker are remembered, so the
+    container is not created again before each write.
+
+    The store is emptied in a forked process (prefork workers) as the
+    connections of the parent process must not be shared.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._containers = set()
+
+    def clear(self):
+        self._local = threading.local()
+        self._containers = set()
+
+    def get_connection(self, key):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            return None
+        return connections.get(key)
+
+    def set_connection(self, key, connection):
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        self._local.connections[key] = connection
+
+    def is_container_checked(self, container):
+        return container in self._containers
+
+    def set_container_checked(self, container):
+        self._containers.add(container)
+
+    def forget_container(self, container):
+        self._containers.discard(container)
+
+
+swift_connection_store = SwiftConnectionStore()
+os.register_at_fork(after_in_child=swift_connection_store.clear)
+
+
+class SegmentReader(io.RawIOBase):
+    """Read a segment of a large object without copying it
+
+    ``swiftclient`` reads the contents by chunks and seeks back to the
+    start when a request is retried.
+    """
+
+    def __init__(self, data):
+        super().__init__()
+        self._data = data
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self._data) - self._pos)
+        buffer[:size] = self._data[self._pos : self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._data)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
 class IrAttachment(models.Model):
     _inherit = "ir.attachment"
 
@@ -81,8 +177,12 @@ class IrAttachment(models.Model):
         return ["swift"] + super()._get_stores()
 
     @api.model
-    def _get_swift_connection(self):
-        """Returns a connection object for the Swift object store"""
+    def _get_swift_connection(self, cached=True):
+        """Returns a connection object for the Swift object store
+
+        The connections are reused by the next calls of the same thread,
+        see ``SwiftConnectionStore``, unless ``cached`` is False.
+        """
         host = os.environ.get("SWIFT_AUTH_URL")
         account = os.environ.get("SWIFT_ACCOUNT")
         password = os.environ.get("SWIFT_PASSWORD")
@@ -105,6 +205,10 @@ class IrAttachment(models.Model):
                     "SWIFT_TENANT_NAME) properly set?"
                 )
             )
+        key = (host, account, password, project_name, region)
+        conn = cached and swift_connection_store.get_connection(key)
+        if conn:
+            return conn
         try:
             session = swift_session_store.get_session(
                 username=account,
@@ -119,6 +223,8 @@ class IrAttachment(models.Model):
         except ClientException:
             _logger.exception("Error connecting to Swift object store")
             raise exceptions.UserError(_("Error on Swift connection")) from None
+        if cached:
+            swift_connection_store.set_connection(key, conn)
         return conn
 
     @api.model
@@ -141,14 +247,69 @@ class IrAttachment(models.Model):
         else:
             return super()._store_file_read(fname)
 
+    @api.model
+    def _store_file_stream(self, fname, start=0, end=None):
+        """Yield the content of the object by chunks
+
+        Only the requested range of bytes is downloaded and a chunk at a
+        time is kept in memory. The response is read while other requests
+        can be done by the thread, so a dedicated connection is used.
+        """
+        if not fname.startswith("swift://"):
+            yield from super()._store_file_stream(fname, start=start, end=end)
+            return
+        swifturi = SwiftUri(fname)
+        headers = {}
+        if start or end is not None:
+            headers["Range"] = "bytes=%d-%s" % (start, "" if end is None else end)
+        try:
+            conn = self._get_swift_connection(cached=False)
+            __, body = conn.get_object(
+                swifturi.container(),
+                swifturi.item(),
+                resp_chunk_size=SWIFT_STREAM_CHUNK_SIZE,
+                headers=headers,
+            )
+        except (exceptions.UserError, ClientException):
+            _logger.exception("Error reading object from Swift object store")
+            return
+        try:
+            yield from body
+        finally:
+            body.close()
+            conn.close()
+
+    @api.model
+    def _store_file_exists(self, key):
+        location = self.env.context.get("storage_location") or self._storage()
+        if location == "swift":
+            container = os.environ.get("SWIFT_WRITE_CONTAINER")
+            conn = self._get_swift_connection()
+            try:
+                conn.head_object(container, key)
+            except ClientException:
+                return False
+            return "swift://{}/{}".format(container, key)
+        return super()._store_file_exists(key)
+
     def _store_file_write(self, key, bin_data):
-        if self._storage() == "swift":
+        location = self.env.context.get("storage_location") or self._storage()
+        if location == "swift":
             container = os.environ.get("SWIFT_WRITE_CONTAINER")
             conn = self._get_swift_connection()
-            conn.put_container(container)
             filename = "swift://{}/{}".format(container, key)
             try:
-                conn.put_object(container, key, bin_data)
+                try:
+                    self._swift_put_object(conn, container, key, bin_data)
+                except ClientException as error:
+                    if error.http_status != 404:
+                        raise
+                    # the container has been deleted in the meantime
+                    swift_connection_store.forget_container(container)
+                    swift_connection_store.forget_container(
+                        self._swift_segment_container(container)
+                    )
+                    self._swift_put_object(conn, container, key, bin_data)
             except ClientException:
                 _logger.exception("Error writing to Swift object store")
                 raise exceptions.UserError(_("Error writing to Swift")) from None
@@ -157,6 +318,99 @@ class IrAttachment(models.Model):
             filename = _super._store_file_write(key, bin_data)
         return filename
 
+    def _swift_put_container(self, conn, container):
+        if not swift_connection_store.is_container_checked(container):
+            conn.put_container(container)
+            swift_connection_store.set_container_checked(container)
+
+    def _swift_segment_container(self, container):
+        return "%s_segments" % (container,)
+
+    def _swift_put_object(self, conn, container, key, bin_data):
+        self._swift_put_container(conn, container)
+        if len(bin_data) <= SWIFT_SEGMENT_SIZE:
+            conn.put_object(container, key, bin_data)
+            return
+        # Swift rejects the objects above 5GB, the large files are sent by
+        # segments, concurrently, then assembled by a manifest
+        segment_container = self._swift_segment_container(container)
+        self._swift_put_container(conn, segment_container)
+        data = memoryview(bin_data)
+        offsets = range(0, len(data), SWIFT_SEGMENT_SIZE)
+
+        def put_segment(index):
+            segment = data[offsets[index] : offsets[index] + SWIFT_SEGMENT_SIZE]
+            name = "%s/slo/%08d" % (key, index)
+            # each thread uses its own connection
+            etag = self._get_swift_connection().put_object(
+                segment_container,
+                name,
+                SegmentReader(segment),
+                content_length=len(segment),
+            )
+            return {
+                "path": "/%s/%s" % (segment_container, name),
+                "etag": etag,
+                "size_bytes": len(segment),
+            }
+
+        with ThreadPoolExecutor(max_workers=SWIFT_SEGMENT_WORKERS) as executor:
+            manifest = list(executor.map(put_segment, range(len(offsets))))
+        conn.put_object(
+            container,
+            key,
+            json.dumps(manifest),
+            query_string="multipart-manifest=put",
+        )
+
+    def _swift_list_segments(self, conn, container, keys):
+        """Return the segments of the large objects of these keys
+
+        The segments of an object are listed with its key as prefix, unless
+        listing the whole segments container needs fewer requests.
+        """
+        segment_container = self._swift_segment_container(container)
+        try:
+            headers = conn.head_container(segment_container)
+        except ClientException as error:
+            if error.http_status == 404:
+                # no large object was ever written
+                return []
+            raise
+        count = int(headers.get("x-container-object-count", 0))
+        if not count:
+            return []
+        if math.ceil(count / SWIFT_LIST_LIMIT) < len(keys):
+            return [
+                (segment_container, obj["name"])
+                for obj in self._swift_list_objects(conn, segment_container)
+                if obj["name"].split("/", 1)[0] in keys
+            ]
+        segments = []
+        for key in keys:
+            segments += [
+                (segment_container, obj["name"])
+                for obj in self._swift_list_objects(
+                    conn, segment_container, prefix="%s/slo/" % (key,)
+                )
+            ]
+        return segments
+
+    def _swift_list_objects(self, conn, container, prefix=None):
+        """Iterate on the objects of the container, in binary order
+
+        The objects are listed by pages of ``SWIFT_LIST_LIMIT``.
+        """
+        marker = ""
+        while True:
+            __, objects = conn.get_container(
+                container, marker=marker, prefix=prefix, limit=SWIFT_LIST_LIMIT
+            )
+            if not objects:
+                return
+            yield from objects
+            marker = objects[-1]["name"]
+
     @api.model
     def _store_file_delete(self, fname):
         if fname.startswith("swift://"):
@@ -174,3 +428,73 @@ class IrAttachment(models.Model):
                     # storage but won't disrupt the process
         else:
             return super()._file_delete_from_store(fname)
+
+    @api.model
+    def _store_list_files(self, storage):
+        if storage == "swift":
+            container = os.environ.get("SWIFT_WRITE_CONTAINER")
+            conn = self._get_swift_connection()
+            prefix = "swift://{}/".format(container)
+            return prefix, self._swift_list_files(conn, container)
+        return super()._store_list_files(storage)
+
+    def _swift_list_files(self, conn, container):
+        prefix = "swift://{}/".format(container)
+        for obj in self._swift_list_objects(conn, container):
+            yield prefix + obj["name"], obj["bytes"]
+
+    @api.model
+    def _store_file_delete_many(self, fnames):
+        """Delete the files of the Swift container with bulk-delete requests
+
+        As in ``_store_file_delete``, only the files of the configured
+        container are deleted, with the segments of the large objects. A
+        request deletes up to 1000 objects. When the bulk middleware is not
+        available, the objects are deleted one by one.
+        """
+        container = os.environ.get("SWIFT_WRITE_CONTAINER")
+        items = []
+        others = []
+        for fname in fnames:
+            if fname.startswith("swift://"):
+                swifturi = SwiftUri(fname)
+                if swifturi.container() == container:
+                    items.append(swifturi.item())
+            else:
+                others.append(fname)
+        if items:
+            conn = self._get_swift_connection()
+            paths = [(container, item) for item in items]
+            try:
+                # the segments of the large objects are deleted with them
+                paths += self._swift_list_segments(conn, container, set(items))
+            except ClientException:
+                _logger.exception("Error listing the segments on the Swift store")
+            for chunk in split_every(1000, paths):
+                data = "\n".join(quote("/%s/%s" % path) for path in chunk)
+                try:
+                    __, body = conn.post_account(
+                        headers={
+                            "Accept": "application/json",
+                            "Content-Type": "text/plain",
+                        },
+                        query_string="bulk-delete",
+                        data=data.encode("utf-8"),
+                    )
+                except ClientException:
+                    _logger.info(
+                        "Bulk deletion not available on the Swift store, "
+                        "deleting the objects one by one"
+                    )
+                    for path in chunk:
+                        try:
+                            conn.delete_object(*path)
+                        except ClientException:
+                            _logger.exception(
+                                _("Error deleting an object on the Swift store")
+                            )
+                    continue
+                for path, error in json.loads(body or "{}").get("Errors", []):
+                    _logger.error("Error during deletion of %s: %s", path, error)
+                _logger.info("%d files deleted on the object storage", len(chunk))
+        return super()._store_file_delete_many(others)
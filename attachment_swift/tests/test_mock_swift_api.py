@@ -2,13 +2,17 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 import base64
+import json
 import os
 
 import keystoneauth1
 import mock
 from mock import patch
 
-from odoo.addons.attachment_swift.models.ir_attachment import SwiftSessionStore
+from odoo.addons.attachment_swift.models.ir_attachment import (
+    SwiftSessionStore,
+    swift_connection_store,
+)
 from odoo.addons.attachment_swift.swift_uri import SwiftUri
 from odoo.addons.base.tests.test_ir_attachment import TestIrAttachment
 
@@ -19,6 +23,12 @@ class TestAttachmentSwift(TestIrAttachment):
         self.env["ir.config_parameter"].set_param("ir_attachment.location", "swift")
         return res
 
+    def setUp(self):
+        super().setUp()
+        # the connections are mocked by the tests, they must not be reused
+        swift_connection_store.clear()
+        self.addCleanup(swift_connection_store.clear)
+
     def test_session_store_get_session(self):
         auth_url = "auth_url"
         username = "username"
@@ -99,6 +109,63 @@ class TestAttachmentSwift(TestIrAttachment):
                 container, attachment._compute_checksum(bin_data), bin_data
             )
 
+    def test_store_files_create_container_once(self):
+        """The container is created before the first write only"""
+        (self.env["ir.config_parameter"].set_param("ir_attachment.location", "swift"))
+        os.environ["SWIFT_AUTH_URL"] = "auth_url"
+        os.environ["SWIFT_ACCOUNT"] = "account"
+        os.environ["SWIFT_PASSWORD"] = "password"
+        os.environ["SWIFT_PROJECT_NAME"] = "project_name"
+        os.environ["SWIFT_WRITE_CONTAINER"] = "my_container"
+        attachment = self.Attachment
+        with patch("swiftclient.client.Connection") as MockConnection:
+            conn = MockConnection.return_value
+            attachment.create({"name": "a5", "datas": self.blob1_b64})
+            attachment.create({"name": "a6", "datas": self.blob2_b64})
+            MockConnection.assert_called_once()
+            conn.put_container.assert_called_once_with("my_container")
+            self.assertEqual(conn.put_object.call_count, 2)
+
+    def test_store_large_file_on_swift(self):
+        """A file larger than a segment is written as a Static Large Object"""
+        (self.env["ir.config_parameter"].set_param("ir_attachment.location", "swift"))
+        os.environ["SWIFT_AUTH_URL"] = "auth_url"
+        os.environ["SWIFT_ACCOUNT"] = "account"
+        os.environ["SWIFT_PASSWORD"] = "password"
+        os.environ["SWIFT_PROJECT_NAME"] = "project_name"
+        os.environ["SWIFT_WRITE_CONTAINER"] = "my_container"
+        attachment = self.Attachment
+        bin_data = base64.b64decode(self.blob1_b64)
+        key = attachment._compute_checksum(bin_data)
+        with patch("swiftclient.client.Connection") as MockConnection, patch(
+            "odoo.addons.attachment_swift.models.ir_attachment.SWIFT_SEGMENT_SIZE", 2
+        ):
+            conn = MockConnection.return_value
+            conn.put_object.return_value = "etag"
+            attachment.create({"name": "a5", "datas": self.blob1_b64})
+            segments = [
+                call
+                for call in conn.put_object.call_args_list
+                if call[0][0] == "my_container_segments"
+            ]
+            self.assertEqual(
+                sorted((call[0][1], call[0][2].read()) for call in segments),
+                [
+                    ("%s/slo/%08d" % (key, index), bin_data[offset : offset + 2])
+                    for index, offset in enumerate(range(0, len(bin_data), 2))
+                ],
+            )
+            args, kwargs = conn.put_object.call_args
+            self.assertEqual(args[:2], ("my_container", key))
+            self.assertEqual(kwargs["query_string"], "multipart-manifest=put")
+            self.assertEqual(
+                [segment["size_bytes"] for segment in json.loads(args[2])],
+                [
+                    len(bin_data[offset : offset + 2])
+                    for offset in range(0, len(bin_data), 2)
+                ],
+            )
+
     def test_delete_file_on_swift(self):
         """
         Test deleting a file
@@ -114,7 +181,46 @@ class TestAttachmentSwift(TestIrAttachment):
         container = os.environ.get("SWIFT_WRITE_CONTAINER")
         with patch("swiftclient.client.Connection") as MockConnection:
             conn = MockConnection.return_value
+            conn.post_account.return_value = ({}, b"{}")
+            conn.head_container.return_value = {"x-container-object-count": "0"}
             a5 = attachment.create({"name": "a5", "datas": self.blob1_b64})
             uri = SwiftUri(a5.store_fname)
             a5.unlink()
-            conn.delete_object.assert_called_with(container, uri.item())
+            # the files are deleted with a bulk-delete request
+            __, kwargs = conn.post_account.call_args
+            self.assertEqual(kwargs["query_string"], "bulk-delete")
+            self.assertEqual(
+                kwargs["data"], ("/%s/%s" % (container, uri.item())).encode("utf-8")
+            )
+
+    def test_delete_large_file_on_swift(self):
+        """The segments of a large object are listed by key and deleted"""
+        (self.env["ir.config_parameter"].set_param("ir_attachment.location", "swift"))
+        os.environ["SWIFT_AUTH_URL"] = "auth_url"
+        os.environ["SWIFT_ACCOUNT"] = "account"
+        os.environ["SWIFT_PASSWORD"] = "password"
+        os.environ["SWIFT_PROJECT_NAME"] = "project_name"
+        os.environ["SWIFT_WRITE_CONTAINER"] = "my_container"
+
+        attachment = self.Attachment
+        with patch("swiftclient.client.Connection") as MockConnection:
+            conn = MockConnection.return_value
+            conn.post_account.return_value = ({}, b"{}")
+            a5 = attachment.create({"name": "a5", "datas": self.blob1_b64})
+            key = SwiftUri(a5.store_fname).item()
+            segment = "%s/slo/%08d" % (key, 0)
+            conn.head_container.return_value = {"x-container-object-count": "100000"}
+            conn.get_container.side_effect = [({}, [{"name": segment}]), ({}, [])]
+            a5.unlink()
+            __, kwargs = conn.get_container.call_args
+            self.assertEqual(kwargs["prefix"], "%s/slo/" % key)
+            __, kwargs = conn.post_account.call_args
+            self.assertEqual(
+                kwargs["data"],
+                "\n".join(
+                    [
+                        "/my_container/%s" % key,
+                        "/my_container_segments/%s" % segment,
+                    ]
+                ).encode("utf-8"),
+            )
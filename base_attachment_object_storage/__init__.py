@@ -1,8 +1,44 @@
+import os
+from contextlib import suppress
+
+from odoo.http import STATIC_CACHE_LONG, Response, Stream, _send_file, request
+
 from . import models
-from odoo.http import Stream
+from .models.ir_attachment import is_true
+from .store_cache import disk_cache, is_content_addressed
+from .store_file import StoreFile
 
 
 old_from_attachment = Stream.from_attachment
+old_get_response = Stream.get_response
+
+
+class StoreStream(Stream):
+    """Stream of a file of an object storage
+
+    The content is sent by chunks while it is downloaded from the store
+    (see ``get_response``), it is only downloaded entirely when ``data``
+    is read (e.g. to resize an image).
+    """
+
+    store_file = None
+    _data = None
+
+    @property
+    def data(self):
+        if self._data is None and self.store_file is not None:
+            self.store_file.seek(0)
+            self._data = self.store_file.read()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def is_streamed(self):
+        return (
+            self.type == "data" and self._data is None and self.store_file is not None
+        )
 
 
 @classmethod
@@ -10,18 +46,88 @@ def from_attachment(cls, attachment):
     if attachment.store_fname and attachment._is_file_from_a_store(
         attachment.store_fname
     ):
-        self = cls(
+        self = StoreStream(
             mimetype=attachment.mimetype,
             download_name=attachment.name,
             conditional=True,
             etag=attachment.checksum,
         )
+        cached_path = (
+            disk_cache
+            and is_content_addressed(attachment.store_fname)
+            and disk_cache.get_path(attachment.store_fname)
+        )
+        stat = None
+        if cached_path:
+            # the file can be evicted by another worker in the meantime
+            with suppress(OSError):
+                stat = os.stat(cached_path)
+        if stat:
+            self.type = "path"
+            self.path = cached_path
+            # the modification time of the cached file is the time of
+            # its last hit
+            self.last_modified = attachment["__last_update"]
+            self.size = stat.st_size
+            return self
         self.type = "data"
-        self.data = attachment.raw
         self.last_modified = attachment["__last_update"]
-        self.size = len(self.data)
+        if attachment.file_size and is_true(
+            os.environ.get("ATTACHMENT_STORAGE_STREAMING", "1")
+        ):
+            # the content is sent by chunks while it is downloaded from
+            # the store, see get_response
+            self.store_file = StoreFile(
+                attachment, attachment.store_fname, attachment.file_size
+            )
+            self.size = attachment.file_size
+        else:
+            self.data = attachment.raw
+            self.size = len(self.data)
         return self
     return old_from_attachment(attachment)
 
 
+def get_response(self, as_attachment=None, immutable=None, **send_file_kwargs):
+    # when the data has been read or replaced (e.g. resized images), the
+    # content is not streamed from the store anymore
+    if not (isinstance(self, StoreStream) and self.is_streamed()):
+        return old_get_response(
+            self, as_attachment=as_attachment, immutable=immutable, **send_file_kwargs
+        )
+    if as_attachment is None:
+        as_attachment = self.as_attachment
+    if immutable is None:
+        immutable = self.immutable
+    conditional = send_file_kwargs.pop("conditional", self.conditional)
+    etag = send_file_kwargs.pop("etag", self.etag)
+    environ = request.httprequest.environ
+    send_file_kwargs = {
+        "mimetype": self.mimetype,
+        "as_attachment": as_attachment,
+        "download_name": self.download_name,
+        "last_modified": self.last_modified,
+        "max_age": STATIC_CACHE_LONG if immutable else self.max_age,
+        "environ": environ,
+        "response_class": Response,
+        **send_file_kwargs,
+        # send_file can't know the size of the file, conditional and
+        # range requests are handled below
+        "conditional": False,
+        "etag": False,
+    }
+    res = _send_file(self.store_file, **send_file_kwargs)
+    res.content_length = self.size
+    if conditional:
+        if etag:
+            res.set_etag(etag)
+        res = res.make_conditional(
+            environ, accept_ranges=True, complete_length=self.size
+        )
+    if immutable and res.cache_control:
+        res.cache_control["immutable"] = None
+    return res
+
+
 Stream.from_attachment = from_attachment
+Stream.get_response = get_response
@@ -5,7 +5,7 @@
 {
     "name": "Base Attachment Object Store",
     "summary": "Base module for the implementation of external object store.",
-    "version": "16.0.1.0.0",
+    "version": "16.0.1.1.0",
     "author": "Camptocamp,Odoo Community Association (OCA)",
     "license": "AGPL-3",
     "category": "Knowledge Management",
@@ -5,19 +5,41 @@ import inspect
 import logging
 import os
 import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing, contextmanager
-
-import psycopg2
+from datetime import timedelta
 
 import odoo
 from odoo import _, api, exceptions, models
 from odoo.osv.expression import AND, OR, normalize_domain
+from odoo.tools import ormcache, split_every
 from odoo.tools.safe_eval import const_eval
 
+from ..store_cache import (
+    disk_cache,
+    is_content_addressed,
+    known_keys_cache,
+    memory_cache,
+)
 from .strtobool import strtobool
 
 _logger = logging.getLogger(__name__)
 
+STORE_READ_WORKERS = int(os.environ.get("ATTACHMENT_STORAGE_READ_WORKERS", 8))
+MIGRATION_WORKERS = int(os.environ.get("ATTACHMENT_STORAGE_MIGRATION_WORKERS", 4))
+MIGRATION_BATCH_SIZE = int(
+    os.environ.get("ATTACHMENT_STORAGE_MIGRATION_BATCH_SIZE", 500)
+)
+MIGRATION_BATCH_MAX_SIZE = (
+    int(os.environ.get("ATTACHMENT_STORAGE_MIGRATION_BATCH_MAX_SIZE", 64)) * 1024 * 1024
+)
+GC_CHUNK_SIZE = int(os.environ.get("ATTACHMENT_STORAGE_GC_CHUNK_SIZE", 100))
+# first key of the advisory locks taken on the files of the stores, the
+# second one is the hash of the name of the file
+GC_LOCK_ID = 0x6F627363
+GC_GENERATION_KEY = "ir_attachment.storage.gc.generation"
+
 
 def is_true(strval):
     return bool(strtobool(strval or "0"))
@@ -40,6 +62,43 @@ def clean_fs(files):
                 )
 
 
+def _gc_lock_name(fname):
+    """Name of the advisory lock of a file of a store
+
+    The last part of the key, lowercased, is the same for the key written
+    and for the name of the file in the store, whatever the store.
+    """
+    return fname.rsplit("/", 1)[-1].lower()
+
+
+class MigrationProgress(object):
+    """Log the progress of a migration of attachments"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.size = 0
+        self.start_time = time.time()
+
+    def add(self, count, size):
+        self.done += count
+        self.size += size
+
+    def log(self):
+        elapsed = max(time.time() - self.start_time, 0.001)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else 0
+        _logger.info(
+            "attachment %s/%s after %.2fs (%.1f files/s, %.2f MB/s, ETA %s)",
+            self.done,
+            self.total,
+            elapsed,
+            rate,
+            self.size / elapsed / 1024 / 1024,
+            timedelta(seconds=int(eta)),
+        )
+
+
 class IrAttachment(models.Model):
     _inherit = "ir.attachment"
 
@@ -55,6 +114,17 @@ class IrAttachment(models.Model):
             _logger.warning(msg)
         return is_disabled
 
+    def init(self):
+        res = super().init()
+        # files of the stores waiting to be deleted when the garbage
+        # collection is deferred, see _file_delete_many
+        self.env.cr.execute(
+            "CREATE TABLE IF NOT EXISTS ir_attachment_store_gc ("
+            "store_fname varchar PRIMARY KEY, "
+            "create_date timestamp DEFAULT (now() at time zone 'UTC'))"
+        )
+        return res
+
     def _register_hook(self):
         super()._register_hook()
         location = self.env.context.get("storage_location") or self._storage()
@@ -109,6 +179,25 @@ class IrAttachment(models.Model):
             storage_config = self._object_storage_default_force_db_config
         return storage_config
 
+    @api.model
+    @ormcache()
+    def _get_storage_force_db_rules(self):
+        """Return the configuration of ``_get_storage_force_db_config`` compiled
+
+        Return a dict ``{mimetype prefix: (position, limit)}`` and the lengths
+        of the prefixes, so a mimetype is matched with a lookup per length
+        instead of a scan of the configuration.
+
+        The result is cached per registry, the cache being cleared when a
+        system parameter is modified.
+        """
+        rules = {}
+        config = self._get_storage_force_db_config()
+        for position, (mimetype_key, limit) in enumerate(config.items()):
+            rules.setdefault(mimetype_key, (position, limit))
+        lengths = tuple(sorted({len(mimetype_key) for mimetype_key in rules}))
+        return rules, lengths
+
     def _store_in_db_instead_of_object_storage_domain(self):
         """Return a domain for attachments that must be forced to DB
 
@@ -173,14 +262,22 @@ class IrAttachment(models.Model):
         """
         if self.is_storage_disabled():
             return True
-        storage_config = self._get_storage_force_db_config()
-        for mimetype_key, limit in storage_config.items():
-            if mimetype.startswith(mimetype_key):
-                if not limit:
-                    return True
-                bin_data = data
-                return len(bin_data) <= limit
-        return False
+        return self._store_size_in_db_instead_of_object_storage(len(data), mimetype)
+
+    def _store_size_in_db_instead_of_object_storage(self, size, mimetype):
+        """Return whether an attachment of this size must be stored in db
+
+        See ``_store_in_db_instead_of_object_storage``.
+        """
+        rules, lengths = self._get_storage_force_db_rules()
+        matches = [
+            rules[mimetype[:length]] for length in lengths if mimetype[:length] in rules
+        ]
+        if not matches:
+            return False
+        # the first matching key of the configuration wins
+        __, limit = min(matches)
+        return not limit or size <= limit
 
     def _get_datas_related_values(self, data, mimetype):
         storage = self.env.context.get("storage_location") or self._storage()
@@ -198,17 +295,128 @@ class IrAttachment(models.Model):
                 return values
         return super()._get_datas_related_values(data, mimetype)
 
+    def _compute_raw(self):
+        # read the files of the stores of the whole recordset concurrently
+        # instead of one after the other
+        if self.env.context.get("bin_size"):
+            return super()._compute_raw()
+        fnames = {
+            attach.store_fname
+            for attach in self
+            if attach.store_fname and self._is_file_from_a_store(attach.store_fname)
+        }
+        if len(fnames) < 2:
+            return super()._compute_raw()
+        files = self._file_read_many(fnames)
+        others = self.browse()
+        for attach in self:
+            if attach.store_fname in files:
+                attach.raw = files[attach.store_fname]
+            else:
+                others |= attach
+        if others:
+            super(IrAttachment, others)._compute_raw()
+
     @api.model
     def _file_read(self, fname):
         if self._is_file_from_a_store(fname):
-            return self._store_file_read(fname)
+            return self._file_read_many([fname])[fname]
         else:
             return super()._file_read(fname)
 
+    @api.model
+    def _file_read_many(self, fnames):
+        """Read files of the stores, using the caches
+
+        Return a dict with the content of each file name.
+        """
+        files = {}
+        missing = []
+        for fname in fnames:
+            data = None
+            # the files with a forced key can be overwritten by another
+            # worker, they are not cached
+            if is_content_addressed(fname):
+                if memory_cache is not None:
+                    data = memory_cache.get(fname)
+                if data is None and disk_cache is not None:
+                    data = disk_cache.get(fname)
+                    if data and memory_cache is not None:
+                        memory_cache.set(fname, data)
+            if data is None:
+                missing.append(fname)
+            else:
+                files[fname] = data
+        if missing:
+            read = self._store_file_read_many(missing)
+            for fname, data in read.items():
+                if data and is_content_addressed(fname):
+                    for cache in (disk_cache, memory_cache):
+                        if cache is not None:
+                            cache.set(fname, data)
+            files.update(read)
+        return files
+
+    @api.model
+    def _store_file_read_many(self, fnames):
+        """Read files of the stores concurrently
+
+        The files are read with ``_store_file_read`` in a pool of
+        ``ATTACHMENT_STORAGE_READ_WORKERS`` threads, so reading N files
+        takes about the time of the slowest read rather than the sum of
+        them. Return a dict with the content of each file name.
+        """
+        fnames = list(dict.fromkeys(fnames))
+        if len(fnames) < 2 or STORE_READ_WORKERS < 2:
+            return {fname: self._store_file_read(fname) for fname in fnames}
+        max_workers = min(STORE_READ_WORKERS, len(fnames))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(fnames, executor.map(self._store_file_read, fnames)))
+
+    @api.model
+    def _store_file_cache_delete(self, fname):
+        for cache in (memory_cache, disk_cache, known_keys_cache):
+            if cache is not None:
+                cache.delete(fname)
+
+    @api.model
+    def get_object_storage_cache_stats(self):
+        """Return the hits and misses of the caches of the current worker"""
+        if not self.env["res.users"].browse(self.env.uid)._is_admin():
+            raise exceptions.AccessError(
+                _("Only administrators can execute this action.")
+            )
+        stats = {}
+        if disk_cache is not None:
+            stats["disk"] = disk_cache.stats()
+        if memory_cache is not None:
+            stats["memory"] = memory_cache.stats()
+        stats["known_keys"] = known_keys_cache.stats()
+        return stats
+
     def _store_file_read(self, fname):
         storage = fname.partition("://")[0]
         raise NotImplementedError("No implementation for %s" % (storage,))
 
+    def _store_file_stream(self, fname, start=0, end=None):
+        """Yield the content of a file of the store by chunks
+
+        ``start`` and ``end`` (inclusive) allow to read only a range of
+        bytes. Stores able to download a file progressively should override
+        this method, the default implementation reads the whole file.
+        """
+        data = self._store_file_read(fname)
+        if data:
+            yield data[start : None if end is None else end + 1]
+
+    def _store_file_exists(self, key):
+        """Return the name of the file of the current store for this key
+
+        Return False when the store has no object for this key. Used to not
+        send again a content that is already in the store.
+        """
+        return False
+
     def _store_file_write(self, key, bin_data):
         storage = self.storage()
         raise NotImplementedError("No implementation for %s" % (storage,))
@@ -217,33 +425,273 @@ class IrAttachment(models.Model):
         storage = fname.partition("://")[0]
         raise NotImplementedError("No implementation for %s" % (storage,))
 
+    def _store_list_files(self, storage):
+        """List the files of the store currently used for writing
+
+        Return the prefix of the file names of this store (e.g.
+        ``s3://bucket/``) and an iterator of ``(file name, size)`` sorted by
+        file name in binary order, with paginated requests so the whole
+        listing is never held in memory.
+        """
+        raise NotImplementedError("No implementation for %s" % (storage,))
+
+    def _store_file_delete_many(self, fnames):
+        """Delete files of the stores
+
+        Stores having a bulk deletion API should override this method to
+        delete the files with as few requests as possible.
+        """
+        for fname in fnames:
+            self._store_file_delete(fname)
+
     @api.model
     def _file_write(self, bin_data, checksum):
         location = self.env.context.get("storage_location") or self._storage()
         if location in self._get_stores():
             key = self.env.context.get("force_storage_key")
-            if not key:
+            if key:
+                self._lock_store_keys([key])
+                filename = self._store_file_write(key, bin_data)
+                # a forced key does not guarantee the content is the same
+                self._store_file_cache_delete(filename)
+            else:
                 key = self._compute_checksum(bin_data)
-            filename = self._store_file_write(key, bin_data)
+                self._lock_store_keys([key])
+                # files already sent on the store by the migration
+                uploaded = self.env.context.get("object_storage_uploaded") or {}
+                filename = uploaded.get(key) or self._store_file_write_once(
+                    key, bin_data
+                )
         else:
             filename = super()._file_write(bin_data, checksum)
         return filename
 
+    def _store_file_write_once(self, key, bin_data):
+        """Send a content to the store unless it already has it
+
+        The keys are the checksums of the contents, so an existing object
+        has the same content. With ``ATTACHMENT_STORAGE_SKIP_EXISTING``,
+        the store is checked before sending the content. With
+        ``ATTACHMENT_STORAGE_DEFERRED_GC``, the keys known by the worker are
+        trusted unless the garbage collector deleted files since they were
+        checked (see ``_get_gc_generation``). The key is locked by
+        ``_file_write``, so its file cannot be deleted in the meantime.
+        """
+        if not is_true(os.environ.get("ATTACHMENT_STORAGE_SKIP_EXISTING")):
+            return self._store_file_write(key, bin_data)
+        filename = generation = None
+        if is_true(os.environ.get("ATTACHMENT_STORAGE_DEFERRED_GC")):
+            generation = self._get_gc_generation()
+            filename = known_keys_cache.get(key, generation)
+        filename = filename or self._store_file_exists(key)
+        if filename:
+            known_keys_cache.add_skipped(len(bin_data))
+        else:
+            filename = self._store_file_write(key, bin_data)
+        if generation is not None:
+            known_keys_cache.set(key, filename, generation)
+        return filename
+
+    @api.model
+    def _get_gc_generation(self):
+        """Return the number of chunks of files deleted by the garbage collector
+
+        Read with SQL rather than ``get_param``, whose cache is only
+        invalidated once the workers are signaled.
+        """
+        self.env.cr.execute(
+            "SELECT value FROM ir_config_parameter WHERE key = %s",
+            (GC_GENERATION_KEY,),
+        )
+        row = self.env.cr.fetchone()
+        return int(row[0]) if row else 0
+
+    @api.model
+    def _increment_gc_generation(self):
+        # not using set_param which would clear the caches of all the
+        # workers after each chunk
+        self.env.cr.execute(
+            "INSERT INTO ir_config_parameter "
+            "(key, value, create_uid, create_date, write_uid, write_date) "
+            "VALUES (%s, '1', %s, now() at time zone 'UTC', "
+            "%s, now() at time zone 'UTC') "
+            "ON CONFLICT (key) DO UPDATE "
+            "SET value = (ir_config_parameter.value::integer + 1)::varchar, "
+            "write_date = EXCLUDED.write_date",
+            (GC_GENERATION_KEY, self.env.uid, self.env.uid),
+        )
+
     @api.model
     def _file_delete(self, fname):
         if self._is_file_from_a_store(fname):
-            cr = self.env.cr
-            # using SQL to include files hidden through unlink or due to record
-            # rules
-            cr.execute(
-                "SELECT COUNT(*) FROM ir_attachment " "WHERE store_fname = %s", (fname,)
-            )
-            count = cr.fetchone()[0]
-            if not count:
-                self._store_file_delete(fname)
+            # when unlinking, all the files are checked at once, see unlink
+            if not self.env.context.get("object_storage_batch_delete"):
+                self._file_delete_many([fname])
         else:
             return super()._file_delete(fname)
 
+    @api.model
+    def _file_delete_many(self, fnames):
+        """Delete the files of the stores which are not used anymore
+
+        With ``ATTACHMENT_STORAGE_DEFERRED_GC``, the files are only queued,
+        and deleted later by ``_gc_object_storage``.
+        """
+        fnames = {fname for fname in fnames if self._is_file_from_a_store(fname)}
+        if not fnames:
+            return
+        if is_true(os.environ.get("ATTACHMENT_STORAGE_DEFERRED_GC")):
+            self._queue_store_files_gc(fnames)
+            return
+        unused = fnames - self._get_used_fnames(fnames)
+        self._store_file_delete_many(list(unused))
+        for fname in unused:
+            self._store_file_cache_delete(fname)
+
+    @api.model
+    def _queue_store_files_gc(self, fnames):
+        for chunk in split_every(self.env.cr.IN_MAX, fnames):
+            self.env.cr.execute(
+                "INSERT INTO ir_attachment_store_gc (store_fname) "
+                "VALUES {} ON CONFLICT DO NOTHING".format(
+                    ", ".join(["(%s)"] * len(chunk))
+                ),
+                chunk,
+            )
+
+    @api.model
+    def _lock_store_keys(self, keys):
+        """Prevent the garbage collector to delete the files of these keys
+
+        The keys are locked until the end of the transaction, which is the
+        one referencing the files. The garbage collector does not delete the
+        files locked by another transaction, and the transactions wait for
+        the files being deleted, so they are sent again.
+        """
+        if not is_true(os.environ.get("ATTACHMENT_STORAGE_DEFERRED_GC")):
+            return
+        self.env.cr.execute(
+            "SELECT pg_advisory_xact_lock_shared(%s, hashtext(name)) "
+            "FROM unnest(%s) AS name",
+            (GC_LOCK_ID, [_gc_lock_name(key) for key in keys]),
+        )
+
+    @api.model
+    def _try_lock_store_files_gc(self, fnames):
+        """Lock the files to delete, until ``_unlock_store_files_gc``
+
+        Return the files which are not locked by another transaction, see
+        ``_lock_store_keys``. The locks are held by the session so they are
+        kept once the transaction is committed.
+        """
+        self.env.cr.execute(
+            "SELECT fname FROM unnest(%s, %s) AS files(fname, name) "
+            "WHERE pg_try_advisory_lock(%s, hashtext(name))",
+            (fnames, [_gc_lock_name(fname) for fname in fnames], GC_LOCK_ID),
+        )
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _unlock_store_files_gc(self, fnames):
+        for chunk in split_every(self.env.cr.IN_MAX, fnames):
+            self.env.cr.execute(
+                "SELECT pg_advisory_unlock(%s, hashtext(name)) "
+                "FROM unnest(%s) AS name",
+                (GC_LOCK_ID, [_gc_lock_name(fname) for fname in chunk]),
+            )
+
+    @api.autovacuum
+    def _gc_object_storage(self):
+        """Delete the queued files of the stores which are not used anymore
+
+        The files are processed by chunks of
+        ``ATTACHMENT_STORAGE_GC_CHUNK_SIZE``. While the references of a chunk
+        are checked, the table ``ir_attachment`` is locked, so no attachment
+        can reference a file being deleted (as Odoo does for the
+        filestore), and the unused files are locked (see
+        ``_lock_store_keys``). The lock of the table is released before the
+        files are deleted with the bulk deletion APIs of the stores, the
+        transactions writing one of these files wait for its deletion. The
+        files locked by another transaction stay queued for the next run.
+        """
+        if self.is_storage_disabled(log=False):
+            return
+        cr = self.env.cr
+        last_fname = ""
+        while True:
+            cr.execute(
+                "SELECT store_fname FROM ir_attachment_store_gc "
+                "WHERE store_fname > %s ORDER BY store_fname LIMIT %s",
+                (last_fname, GC_CHUNK_SIZE),
+            )
+            fnames = [row[0] for row in cr.fetchall()]
+            if not fnames:
+                break
+            last_fname = fnames[-1]
+            cr.execute("LOCK ir_attachment IN SHARE MODE")
+            locked = self._try_lock_store_files_gc(fnames)
+            try:
+                used = self._get_used_fnames(locked) if locked else set()
+                # the files of uninstalled stores are dropped from the queue
+                unused = [
+                    fname
+                    for fname in locked
+                    if fname not in used and self._is_file_from_a_store(fname)
+                ]
+                if locked:
+                    cr.execute(
+                        "DELETE FROM ir_attachment_store_gc WHERE store_fname IN %s",
+                        (tuple(locked),),
+                    )
+                if unused:
+                    # the workers must check again the keys they know
+                    self._increment_gc_generation()
+                # commit to release the lock of the table
+                cr.commit()  # pylint: disable=invalid-commit
+                self._store_file_delete_many(unused)
+                for fname in unused:
+                    self._store_file_cache_delete(fname)
+            except Exception:
+                # the locks can only be released in a valid transaction
+                cr.rollback()
+                raise
+            finally:
+                self._unlock_store_files_gc(locked)
+            _logger.info(
+                "%d files deleted from the object storage, %d still in use, "
+                "%d being written",
+                len(unused),
+                len(locked) - len(unused),
+                len(fnames) - len(locked),
+            )
+
+    @api.model
+    def _get_used_fnames(self, fnames):
+        """Return the file names still referenced by an attachment
+
+        Using SQL to include files hidden through unlink or due to record
+        rules. The file names are checked by chunks of 1000 in a query.
+        """
+        used = set()
+        for chunk in split_every(self.env.cr.IN_MAX, fnames):
+            self.env.cr.execute(
+                "SELECT DISTINCT store_fname FROM ir_attachment "
+                "WHERE store_fname IN %s",
+                (chunk,),
+            )
+            used.update(row[0] for row in self.env.cr.fetchall())
+        return used
+
+    def unlink(self):
+        fnames = {fname for fname in self.mapped("store_fname") if fname}
+        # check the references of all the files of the stores with a query
+        # per 1000 files, rather than a query per file in _file_delete
+        res = super(
+            IrAttachment, self.with_context(object_storage_batch_delete=True)
+        ).unlink()
+        self._file_delete_many(fnames)
+        return res
+
     @api.model
     def _is_file_from_a_store(self, fname):
         for store_name in self._get_stores():
@@ -354,39 +802,293 @@ class IrAttachment(models.Model):
 
         with self.do_in_new_env(new_cr=new_cr) as new_env:
             model_env = new_env["ir.attachment"].with_context(prefetch_fields=False)
-            attachment_ids = model_env.search(domain).ids
+            attachment_ids = model_env.search(domain, order="id").ids
             if not attachment_ids:
                 return
-            total = len(attachment_ids)
-            start_time = time.time()
             _logger.info(
-                "Moving %d attachments from %s to" " DB for fast access", total, storage
+                "Moving %d attachments from %s to" " DB for fast access",
+                len(attachment_ids),
+                storage,
+            )
+            progress = MigrationProgress(len(attachment_ids))
+            new_env.cr.execute(
+                "SELECT id, store_fname, file_size FROM ir_attachment "
+                "WHERE id IN %s ORDER BY id",
+                (tuple(attachment_ids),),
+            )
+            # the files of a batch are all kept in memory, the batches are
+            # limited in number of files and in size
+            for batch in model_env._split_migration_batches(new_env.cr.fetchall()):
+                old_fnames = model_env._move_attachments_to_db(batch)
+                progress.add(len(batch), sum(size or 0 for __, __, size in batch))
+                # commit before the files are potentially dropped on the
+                # bucket
+                new_env.cr.commit()  # pylint: disable=invalid-commit
+                model_env._release_migrated_files(old_fnames)
+                progress.log()
+
+    @api.model
+    def _split_migration_batches(self, rows):
+        """Split (id, store_fname, file_size) rows in batches
+
+        A batch has at most ``ATTACHMENT_STORAGE_MIGRATION_BATCH_SIZE``
+        files and ``ATTACHMENT_STORAGE_MIGRATION_BATCH_MAX_SIZE`` MB.
+        """
+        batch = []
+        batch_size = 0
+        for row in rows:
+            size = row[2] or 0
+            if batch and (
+                len(batch) >= MIGRATION_BATCH_SIZE
+                or batch_size + size > MIGRATION_BATCH_MAX_SIZE
+            ):
+                yield batch
+                batch = []
+                batch_size = 0
+            batch.append(row)
+            batch_size += size
+        if batch:
+            yield batch
+
+    @api.model
+    def _move_attachments_to_db(self, rows):
+        """Move a batch of attachments from the object storage to the database
+
+        ``rows`` is a list of ``(id, store_fname, file_size)``. The files are
+        read concurrently, and as their content does not change, only the
+        ``db_datas`` and ``store_fname`` columns are updated, with a single
+        query (or by ORM writes if ``ATTACHMENT_STORAGE_MIGRATION_FAST`` is
+        disabled).
+
+        Return the former file names of the attachments, to release once the
+        changes are committed.
+        """
+        files = self._store_file_read_many([fname for __, fname, __ in rows])
+        updates = []
+        for attachment_id, fname, __ in rows:
+            if not files.get(fname):
+                _logger.warning(
+                    "attachment %s not moved to DB: could not read %s",
+                    attachment_id,
+                    fname,
+                )
+                continue
+            updates.append((attachment_id, fname, files[fname]))
+        if not updates:
+            return set()
+        if is_true(os.environ.get("ATTACHMENT_STORAGE_MIGRATION_FAST", "1")):
+            self.env.flush_all()
+            # only update the rows whose file has not been changed meanwhile
+            query = (
+                "UPDATE ir_attachment AS a "
+                "SET db_datas = v.db_datas, store_fname = NULL "
+                "FROM (VALUES {}) AS v(id, store_fname, db_datas) "
+                "WHERE a.id = v.id AND a.store_fname = v.store_fname"
+            ).format(", ".join(["(%s, %s, %s)"] * len(updates)))
+            params = [value for update in updates for value in update]
+            self.env.cr.execute(query, params)
+            self.browse([update[0] for update in updates]).invalidate_recordset()
+            return {fname for __, fname, __ in updates}
+        for attachment_id, __, data in updates:
+            # the location to write is decided by the 'raw' inverse field,
+            # which also drops the former file
+            self.browse(attachment_id).write({"raw": data})
+        return set()
+
+    def _upload_file_to_store(self, fname, checksum=None):
+        """Send a file of the filestore on the object storage
+
+        When the checksum of the file is known and the store already has an
+        object for this key, the file is neither read nor sent again.
+
+        Called from the threads of the migration, so it must not query the
+        database. Return the key and the name of the file in the store.
+        """
+        if checksum:
+            filename = self._store_file_exists(checksum)
+            if filename:
+                return checksum, filename
+        data = self._file_read(fname)
+        if not data:
+            return None, None
+        key = self._compute_checksum(data)
+        return key, self._store_file_write(key, data)
+
+    def _move_attachments_to_store(self, progress=None, skipped=None):
+        """Move a batch of attachments on the object storage
+
+        The attachments sharing the same checksum share the same content:
+        it is sent once on the object storage, by
+        ``ATTACHMENT_STORAGE_MIGRATION_WORKERS`` concurrent threads, and as
+        the content does not change, only the ``store_fname`` of the
+        attachments of the batch is updated, with a single query (unless
+        ``ATTACHMENT_STORAGE_MIGRATION_FAST`` is disabled).
+
+        The other attachments (stored in database, without checksum or kept
+        in database according to ``_store_in_db_instead_of_object_storage``)
+        are written one by one, without sending their content again.
+
+        The attachments locked by another transaction are not migrated,
+        their ids are added to the ``skipped`` list when it is given.
+
+        Return the paths of the files to remove from the filestore once the
+        changes are committed.
+        """
+        cr = self.env.cr
+        # don't send a file to storage when another transaction has locked
+        # the row
+        cr.execute(
+            "SELECT id, store_fname, mimetype, file_size, checksum "
+            "FROM ir_attachment "
+            "WHERE id IN %s "
+            "ORDER BY id "
+            "FOR UPDATE SKIP LOCKED",
+            (tuple(self.ids),),
+        )
+        rows = cr.fetchall()
+        locked_ids = sorted(set(self.ids) - {row[0] for row in rows})
+        if skipped is not None:
+            skipped += locked_ids
+        else:
+            self._log_unmigrated_attachments(locked_ids)
+        groups = defaultdict(list)
+        for attachment_id, fname, mimetype, size, checksum in rows:
+            if (
+                fname
+                and checksum
+                and not self._store_size_in_db_instead_of_object_storage(
+                    size or 0, mimetype or ""
+                )
+            ):
+                groups[checksum].append((attachment_id, fname))
+
+        uploaded = {}
+        if groups:
+            checksums = list(groups)
+            self._lock_store_keys(checksums)
+            fnames = [groups[checksum][0][1] for checksum in checksums]
+            with ThreadPoolExecutor(max_workers=MIGRATION_WORKERS) as executor:
+                for key, filename in executor.map(
+                    self._upload_file_to_store, fnames, checksums
+                ):
+                    if key:
+                        uploaded[key] = filename
+
+        moved_ids = set()
+        old_fnames = set()
+        if is_true(os.environ.get("ATTACHMENT_STORAGE_MIGRATION_FAST", "1")):
+            updates = []
+            for checksum, group in groups.items():
+                filename = uploaded.get(checksum)
+                if not filename:
+                    # the content does not match the checksum
+                    continue
+                for attachment_id, fname in group:
+                    updates.append((attachment_id, filename))
+                    moved_ids.add(attachment_id)
+                    old_fnames.add(fname)
+            if updates:
+                self._update_store_fnames(updates)
+
+        model = self.with_context(object_storage_uploaded=uploaded)
+        for attachment_id, fname, __, __, __ in rows:
+            if attachment_id in moved_ids:
+                continue
+            attachment = model.browse(attachment_id)
+            if attachment._move_attachment_to_store():
+                old_fnames.add(fname)
+            # don't keep the content of the files of the batch in the cache
+            self.env.invalidate_all()
+        if progress:
+            progress.add(len(rows), sum(row[3] or 0 for row in rows))
+        return self._release_migrated_files(old_fnames)
+
+    @api.model
+    def _update_store_fnames(self, updates):
+        """Set the store_fname of attachments whose content does not change
+
+        ``updates`` is a list of ``(id, store_fname)``. The content being
+        the same, the fields computed from it (checksum, file_size,
+        index_content, mimetype) are still valid, so all the rows are
+        updated with a single query instead of an ORM write per attachment.
+        """
+        self.env.flush_all()
+        query = (
+            "UPDATE ir_attachment AS a "
+            "SET store_fname = v.store_fname, db_datas = NULL "
+            "FROM (VALUES {}) AS v(id, store_fname) "
+            "WHERE a.id = v.id"
+        ).format(", ".join(["(%s, %s)"] * len(updates)))
+        params = [value for update in updates for value in update]
+        self.env.cr.execute(query, params)
+        self.browse(
+            [attachment_id for attachment_id, __ in updates]
+        ).invalidate_recordset()
+
+    @api.model
+    def _release_migrated_files(self, fnames):
+        """Release the former files of migrated attachments
+
+        The files still used by other attachments are kept. Return the paths
+        of the files to remove from the filestore once the changes are
+        committed.
+        """
+        if not fnames:
+            return []
+        fnames = fnames - self._get_used_fnames(fnames)
+        self._file_delete_many(fnames)
+        return [
+            self._full_path(fname)
+            for fname in fnames
+            if not self._is_file_from_a_store(fname)
+        ]
+
+    @api.model
+    def _get_migration_checkpoint(self, storage):
+        self.env.cr.execute(
+            "SELECT value FROM ir_config_parameter WHERE key = %s",
+            ("ir_attachment.storage.migration.%s.last_id" % storage,),
+        )
+        row = self.env.cr.fetchone()
+        return int(row[0]) if row else 0
+
+    @api.model
+    def _set_migration_checkpoint(self, storage, last_id):
+        # not using set_param which would clear the caches of all the
+        # workers after each batch
+        key = "ir_attachment.storage.migration.%s.last_id" % storage
+        if last_id:
+            self.env.cr.execute(
+                "INSERT INTO ir_config_parameter "
+                "(key, value, create_uid, create_date, write_uid, write_date) "
+                "VALUES (%s, %s, %s, now() at time zone 'UTC', "
+                "%s, now() at time zone 'UTC') "
+                "ON CONFLICT (key) DO UPDATE "
+                "SET value = EXCLUDED.value, write_date = EXCLUDED.write_date",
+                (key, str(last_id), self.env.uid, self.env.uid),
+            )
+        else:
+            self.env.cr.execute(
+                "DELETE FROM ir_config_parameter WHERE key = %s", (key,)
+            )
+
+    @api.model
+    def _log_unmigrated_attachments(self, ids):
+        for attachment_id in ids:
+            _logger.error(
+                "Could not migrate attachment %s to the object storage", attachment_id
             )
-            current = 0
-            for attachment_id in attachment_ids:
-                current += 1
-                # if we browse attachments outside of the loop, the first
-                # access to 'datas' will compute all the 'datas' fields at
-                # once, which means reading hundreds or thousands of files at
-                # once, exhausting memory
-                attachment = model_env.browse(attachment_id)
-                # this write will read the datas from the Object Storage and
-                # write them back in the DB (the logic for location to write is
-                # in the 'datas' inverse computed field)
-                attachment.write({"datas": attachment.datas})
-                # as the file will potentially be dropped on the bucket,
-                # we should commit the changes here
-                new_env.cr.commit()
-                if current % 100 == 0 or total - current == 0:
-                    _logger.info(
-                        "attachment %s/%s after %.2fs",
-                        current,
-                        total,
-                        time.time() - start_time,
-                    )
 
     @api.model
     def _force_storage_to_object_storage(self, new_cr=False):
+        """Move the attachments of the filestore/database to the object storage
+
+        The attachments are migrated by batches of
+        ``ATTACHMENT_STORAGE_MIGRATION_BATCH_SIZE``. With ``new_cr``, each
+        batch is committed and the last migrated id is kept in the
+        ``ir_attachment.storage.migration.<storage>.last_id`` system
+        parameter, so an interrupted migration resumes after it.
+        """
         _logger.info("migrating files to the object storage")
         storage = self.env.context.get("storage_location") or self._storage()
         if self.is_storage_disabled(storage):
@@ -409,38 +1111,48 @@ class IrAttachment(models.Model):
         # serialization issues due to concurrent updates on attachments during
         # the installation
         with self.do_in_new_env(new_cr=new_cr) as new_env:
-            model_env = new_env["ir.attachment"]
-            ids = model_env.search(domain).ids
+            # the storage is given in the context so the threads sending the
+            # files don't have to read it in the database
+            model_env = new_env["ir.attachment"].with_context(storage_location=storage)
+            if new_cr:
+                last_id = model_env._get_migration_checkpoint(storage)
+                if last_id:
+                    _logger.info("resuming the migration after attachment %s", last_id)
+                    domain = AND([domain, [("id", ">", last_id)]])
+            ids = model_env.search(domain, order="id").ids
+            progress = MigrationProgress(len(ids))
             files_to_clean = []
-            for attachment_id in ids:
-                try:
-                    with new_env.cr.savepoint():
-                        # check that no other transaction has
-                        # locked the row, don't send a file to storage
-                        # in that case
-                        self.env.cr.execute(
-                            "SELECT id "
-                            "FROM ir_attachment "
-                            "WHERE id = %s "
-                            "FOR UPDATE NOWAIT",
-                            (attachment_id,),
-                            log_exceptions=False,
-                        )
-
-                        # This is a trick to avoid having the 'datas'
-                        # function fields computed for every attachment on
-                        # each iteration of the loop. The former issue
-                        # being that it reads the content of the file of
-                        # ALL the attachments on each loop.
-                        new_env.clear()
-                        attachment = model_env.browse(attachment_id)
-                        path = attachment._move_attachment_to_store()
-                        if path:
-                            files_to_clean.append(path)
-                except psycopg2.OperationalError:
-                    _logger.error(
-                        "Could not migrate attachment %s to S3", attachment_id
+            # the attachments locked by other transactions are retried at
+            # the end, the checkpoint must stay before them
+            skipped = []
+
+            def migrate(ids):
+                nonlocal files_to_clean
+                for batch_ids in split_every(MIGRATION_BATCH_SIZE, ids):
+                    batch = model_env.browse(batch_ids)
+                    files_to_clean += batch._move_attachments_to_store(
+                        progress=progress, skipped=skipped
                     )
+                    if new_cr:
+                        last_id = min(skipped) - 1 if skipped else batch_ids[-1]
+                        model_env._set_migration_checkpoint(storage, last_id)
+                        # disable pylint error because this is a valid commit,
+                        # we are in a new env
+                        new_env.cr.commit()  # pylint: disable=invalid-commit
+                        clean_fs(files_to_clean)
+                        files_to_clean = []
+                    progress.log()
+
+            migrate(ids)
+            if skipped:
+                _logger.info("retrying %d locked attachments", len(skipped))
+                retry_ids, skipped = skipped, []
+                migrate(retry_ids)
+            model_env._log_unmigrated_attachments(skipped)
+            if new_cr:
+                # resume before the attachments which are still locked
+                last_id = min(skipped) - 1 if skipped else False
+                model_env._set_migration_checkpoint(storage, last_id)
 
             # delete the files from the filesystem once we know the changes
             # have been committed in ir.attachment
@@ -448,6 +1160,87 @@ class IrAttachment(models.Model):
                 new_env.cr.commit()
                 clean_fs(files_to_clean)
 
+    @api.model
+    def _scan_object_storage(self, storage):
+        """Compare the attachments with the files of the store
+
+        The listing of the store and the file names of the attachments, read
+        with a server-side cursor in the same order, are compared in a
+        single merge pass, so the memory stays bounded whatever the number
+        of files.
+
+        Yield ``(status, file name, size in database, size in store)`` where
+        status is ``missing`` (no file in the store), ``orphaned`` (no
+        attachment for the file) or ``size_mismatch``.
+        """
+        prefix, store_files = self._store_list_files(storage)
+        self.env.flush_all()
+        # a named psycopg2 cursor is a server-side cursor, fetching the rows
+        # by chunks of itersize
+        with closing(self.env.cr._cnx.cursor("ir_attachment_store_scan")) as cursor:
+            cursor.itersize = 10000
+            # COLLATE "C" sorts by bytes, as the listings of the stores
+            cursor.execute(
+                'SELECT store_fname COLLATE "C", max(file_size) '
+                "FROM ir_attachment "
+                "WHERE starts_with(store_fname, %s) "
+                "GROUP BY 1 ORDER BY 1",
+                (prefix,),
+            )
+            db_files = iter(cursor)
+            store_file = next(store_files, None)
+            db_file = next(db_files, None)
+            while store_file or db_file:
+                if db_file is None or (store_file and store_file[0] < db_file[0]):
+                    yield "orphaned", store_file[0], None, store_file[1]
+                    store_file = next(store_files, None)
+                elif store_file is None or db_file[0] < store_file[0]:
+                    yield "missing", db_file[0], db_file[1], None
+                    db_file = next(db_files, None)
+                else:
+                    if db_file[1] is not None and db_file[1] != store_file[1]:
+                        yield "size_mismatch", db_file[0], db_file[1], store_file[1]
+                    store_file = next(store_files, None)
+                    db_file = next(db_files, None)
+
+    @api.model
+    def scan_object_storage(self, max_samples=100):
+        """Report the inconsistencies between the attachments and the store
+
+        Compare the attachments of the current storage with the files of
+        the bucket/container and log the files missing in the store, the
+        files of the store not used by any attachment and the files whose
+        size differs.
+
+        Return the number of files for each kind of inconsistency and the
+        first ``max_samples`` file names of each.
+
+        It is not called anywhere, but can be called by RPC or scripts.
+        """
+        if not self.env["res.users"].browse(self.env.uid)._is_admin():
+            raise exceptions.AccessError(
+                _("Only administrators can execute this action.")
+            )
+        storage = self.env.context.get("storage_location") or self._storage()
+        if storage not in self._get_stores() or self.is_storage_disabled(storage):
+            return {}
+        _logger.info("scanning the files of the %s object storage", storage)
+        counts = Counter()
+        samples = defaultdict(list)
+        for status, fname, db_size, store_size in self._scan_object_storage(storage):
+            counts[status] += 1
+            if len(samples[status]) < max_samples:
+                samples[status].append(fname)
+            _logger.info(
+                "%s: %s (size in database: %s, size in store: %s)",
+                status,
+                fname,
+                db_size,
+                store_size,
+            )
+        _logger.info("scan of the %s object storage done: %s", storage, dict(counts))
+        return {"counts": dict(counts), "samples": dict(samples)}
+
     def _get_stores(self):
         """To get the list of stores activated in the system"""
         return []
@@ -0,0 +1,298 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import suppress
+
+_logger = logging.getLogger(__name__)
+
+CHECKSUM_RE = re.compile(r"[0-9a-f]{40}")
+
+
+def is_content_addressed(fname):
+    """Return whether the key of a file of the store is its checksum
+
+    Only these files can be cached: a file written with a forced key
+    (``force_storage_key``) can be overwritten with another content under
+    the same name, and the caches of the other hosts would not know it.
+    """
+    return bool(CHECKSUM_RE.fullmatch(fname.rpartition("/")[2]))
+
+
+class DiskCache(object):
+    """Local read-through cache of the files of the object storage
+
+    The keys of the files in the object storage are their checksums, so a
+    ``store_fname`` always designates the same content and can be cached
+    without invalidation. The files with a forced key are not cached, see
+    ``is_content_addressed``.
+
+    The files are stored in ``path`` which can be shared between the
+    workers of the same host. A file is written in a temporary file then
+    renamed, so a worker never reads a partially written file. The
+    modification time of a file is updated on each hit, when the size of
+    the cache exceeds ``max_size`` (in bytes), the least recently used
+    files are removed until the cache is back to 90% of its size.
+
+    The size of the directory is only computed after a worker has written
+    10% of ``max_size``, so the cache may temporarily exceed its limit.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._written = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def _get_path(self, fname):
+        digest = hashlib.sha1(fname.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get_path(self, fname):
+        """Return the path of the cached file or None"""
+        path = self._get_path(fname)
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, fname):
+        path = self.get_path(fname)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except OSError:
+            # evicted by another worker in the meantime
+            return None
+
+    def set(self, fname, data):
+        path = self._get_path(fname)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            _logger.warning(
+                "could not write %s in the disk cache", fname, exc_info=True
+            )
+            return
+        with self._lock:
+            self._written += len(data)
+            must_evict = self._written > self.max_size // 10
+            if must_evict:
+                self._written = 0
+        if must_evict:
+            self.evict()
+
+    def delete(self, fname):
+        with suppress(OSError):
+            os.unlink(self._get_path(fname))
+
+    def evict(self):
+        """Remove the least recently used files exceeding the size limit"""
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # another worker is already cleaning the cache
+                return
+            entries = []
+            total = 0
+            for root, __, files in os.walk(self.path):
+                for name in files:
+                    if name.startswith("."):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_size:
+                return
+            target = self.max_size * 0.9
+            entries.sort()
+            removed = 0
+            for __, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            _logger.info("%d files evicted from the disk cache", removed)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class MemoryCache(object):
+    """In-process LRU cache for the small files of the object storage
+
+    Only the files up to ``max_file_size`` bytes are kept, for a total of
+    ``max_size`` bytes per worker, the least recently used files being
+    dropped first. As for ``DiskCache``, the content of a ``store_fname``
+    never changes, the files with a forced key are not cached.
+    """
+
+    def __init__(self, max_size, max_file_size):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._files = OrderedDict()
+        self._size = 0
+
+    def get(self, fname):
+        with self._lock:
+            data = self._files.get(fname)
+            if data is None:
+                self.misses += 1
+                return None
+            self._files.move_to_end(fname)
+            self.hits += 1
+            return data
+
+    def set(self, fname, data):
+        if len(data) > self.max_file_size:
+            return
+        with self._lock:
+            previous = self._files.pop(fname, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._files[fname] = data
+            self._size += len(data)
+            while self._size > self.max_size:
+                __, evicted = self._files.popitem(last=False)
+                self._size -= len(evicted)
+
+    def delete(self, fname):
+        with self._lock:
+            data = self._files.pop(fname, None)
+            if data is not None:
+                self._size -= len(data)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "files": len(self._files),
+            "size": self._size,
+        }
+
+
+class KnownKeysCache(object):
+    """Keys known to exist in the object storage, with the bytes saved
+
+    Keep, for ``ttl`` seconds, the name of the file of the keys written or
+    found in the object storage by the worker, so the same content is not
+    checked nor sent again. A file can be deleted by another worker in the
+    meantime: a key is only returned for the ``generation`` it was set
+    with, which changes each time the garbage collector deletes files. At
+    most ``max_keys`` keys are kept, the oldest being dropped first.
+    """
+
+    def __init__(self, max_keys, ttl):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.skipped = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                return None
+            filename, deadline, entry_generation = entry
+            if deadline < time.monotonic() or entry_generation != generation:
+                del self._keys[key]
+                return None
+            return filename
+
+    def set(self, key, filename, generation):
+        with self._lock:
+            self._keys.pop(key, None)
+            self._keys[key] = (filename, time.monotonic() + self.ttl, generation)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+    def delete(self, fname):
+        key = fname.rpartition("/")[2]
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and entry[0] == fname:
+                del self._keys[key]
+
+    def add_skipped(self, size):
+        with self._lock:
+            self.skipped += 1
+            self.bytes_saved += size
+
+    def stats(self):
+        return {
+            "skipped": self.skipped,
+            "bytes_saved": self.bytes_saved,
+            "keys": len(self._keys),
+        }
+
+
+def _build_disk_cache():
+    path = os.environ.get("ATTACHMENT_STORAGE_DISK_CACHE_DIR")
+    if not path:
+        return None
+    max_size = int(os.environ.get("ATTACHMENT_STORAGE_DISK_CACHE_SIZE", 1024))
+    return DiskCache(path, max_size * 1024 * 1024)
+
+
+disk_cache = _build_disk_cache()
+
+
+def _build_memory_cache():
+    max_size = os.environ.get("ATTACHMENT_STORAGE_MEMORY_CACHE_SIZE")
+    if not max_size:
+        return None
+    max_file_size = int(
+        os.environ.get("ATTACHMENT_STORAGE_MEMORY_CACHE_MAX_FILE_SIZE", 262144)
+    )
+    return MemoryCache(int(max_size) * 1024 * 1024, max_file_size)
+
+
+memory_cache = _build_memory_cache()
+
+
+def _build_known_keys_cache():
+    max_keys = int(os.environ.get("ATTACHMENT_STORAGE_KNOWN_KEYS", 10000))
+    ttl = int(os.environ.get("ATTACHMENT_STORAGE_KNOWN_KEYS_TTL", 300))
+    return KnownKeysCache(max_keys, ttl)
+
+
+known_keys_cache = _build_known_keys_cache()
@@ -0,0 +1,86 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import io
+
+
+class StoreFile(io.RawIOBase):
+    """Read-only file object over a file of an object storage
+
+    The content is downloaded progressively with
+    ``ir.attachment._store_file_stream`` when the file is read, so only a
+    chunk is kept in memory at a time. Seeking (used by werkzeug to serve
+    Range requests) starts a new download from the requested position.
+
+    The file is read once the HTTP response is sent, after the
+    transaction of the request is closed: the implementations of
+    ``_store_file_stream`` must not query the database.
+    """
+
+    def __init__(self, attachment, fname, size):
+        super().__init__()
+        self._attachment = attachment
+        self._fname = fname
+        self._size = size
+        self._position = 0
+        self._chunks = None
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError("invalid whence (%r)" % (whence,))
+        if position < 0:
+            raise ValueError("negative seek position %d" % (position,))
+        if position != self._position:
+            self._close_chunks()
+            self._position = position
+        return self._position
+
+    def _close_chunks(self):
+        if self._chunks is not None:
+            self._chunks.close()
+        self._chunks = None
+        self._buffer = memoryview(b"")
+
+    def _next_buffer(self):
+        if self._position >= self._size:
+            return False
+        if self._chunks is None:
+            self._chunks = self._attachment._store_file_stream(
+                self._fname, start=self._position
+            )
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self._buffer = memoryview(chunk)
+        return True
+
+    def readinto(self, b):
+        # io.RawIOBase.read and readall are implemented with readinto
+        if not len(b) or not self._next_buffer():
+            return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self._position += size
+        return size
+
+    def close(self):
+        self._close_chunks()
+        return super().close()
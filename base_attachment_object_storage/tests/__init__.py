@@ -0,0 +1,4 @@
+from . import test_stream
+from . import test_cache
+from . import test_migration
+from . import test_delete
@@ -0,0 +1,53 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+from unittest.mock import patch
+
+
+class FakeStoreMixin(object):
+    """Store the attachments in a dict, as an object storage named 'fake'
+
+    The methods of the stores are patched on the ``ir.attachment`` model
+    for the duration of the test.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.fake_store = {}
+        self.fake_store_deleted = []
+        model_class = type(self.env["ir.attachment"])
+        fake_store = self.fake_store
+        deleted = self.fake_store_deleted
+
+        def _get_stores(model):
+            return ["fake"]
+
+        def _store_file_read(model, fname):
+            return fake_store.get(fname, b"")
+
+        def _store_file_exists(model, key):
+            fname = "fake://bucket/%s" % (key,)
+            return fname if fname in fake_store else False
+
+        def _store_file_write(model, key, bin_data):
+            fname = "fake://bucket/%s" % (key,)
+            fake_store[fname] = bin_data
+            return fname
+
+        def _store_file_delete(model, fname):
+            fake_store.pop(fname, None)
+            deleted.append(fname)
+
+        for name, method in (
+            ("_get_stores", _get_stores),
+            ("_store_file_read", _store_file_read),
+            ("_store_file_exists", _store_file_exists),
+            ("_store_file_write", _store_file_write),
+            ("_store_file_delete", _store_file_delete),
+        ):
+            patcher = patch.object(model_class, name, method)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.env["ir.config_parameter"].sudo().set_param(
+            "ir_attachment.location", "fake"
+        )
@@ -0,0 +1,94 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import base64
+import os
+import tempfile
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase
+
+from ..store_cache import (
+    DiskCache,
+    KnownKeysCache,
+    MemoryCache,
+    is_content_addressed,
+)
+from .common import FakeStoreMixin
+
+MODULE = "odoo.addons.base_attachment_object_storage.models.ir_attachment"
+
+
+class TestCache(FakeStoreMixin, TransactionCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.disk_cache = DiskCache(tmpdir.name, 1024 * 1024)
+        self.memory_cache = MemoryCache(1024 * 1024, 1024 * 1024)
+        for name, cache in (
+            ("disk_cache", self.disk_cache),
+            ("memory_cache", self.memory_cache),
+        ):
+            patcher = patch("%s.%s" % (MODULE, name), cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # files above the 50KB stored in the database
+        self.content = os.urandom(60 * 1024)
+
+    def _read(self, fname):
+        self.env["ir.attachment"].invalidate_model()
+        return self.env["ir.attachment"]._file_read(fname)
+
+    def test_is_content_addressed(self):
+        self.assertTrue(is_content_addressed("s3://bucket/" + "a" * 40))
+        self.assertFalse(is_content_addressed("s3://bucket/partner/file.txt"))
+        self.assertFalse(is_content_addressed("s3://bucket/" + "a" * 41))
+
+    def test_checksum_key_cached(self):
+        attachment = self.env["ir.attachment"].create(
+            {"name": "a", "datas": base64.b64encode(self.content)}
+        )
+        fname = attachment.store_fname
+        self.assertEqual(self._read(fname), self.content)
+        self.assertEqual(self.disk_cache.get(fname), self.content)
+        self.assertEqual(self.memory_cache.get(fname), self.content)
+
+    def test_forced_key_not_cached(self):
+        attachment = (
+            self.env["ir.attachment"]
+            .with_context(force_storage_key="partner/file.bin")
+            .create({"name": "a", "datas": base64.b64encode(self.content)})
+        )
+        fname = attachment.store_fname
+        self.assertEqual(fname, "fake://bucket/partner/file.bin")
+        self.assertEqual(self._read(fname), self.content)
+        self.assertIsNone(self.disk_cache.get_path(fname))
+        self.assertIsNone(self.memory_cache.get(fname))
+        # overwritten by another host
+        self.fake_store[fname] = b"new content"
+        self.assertEqual(self._read(fname), b"new content")
+
+    def test_known_keys_gc_generation(self):
+        """The known keys are checked again once the garbage collector
+        deleted files"""
+        env = {
+            "ATTACHMENT_STORAGE_SKIP_EXISTING": "1",
+            "ATTACHMENT_STORAGE_DEFERRED_GC": "1",
+        }
+        known_keys = KnownKeysCache(100, 300)
+        model = self.env["ir.attachment"]
+        with patch.dict(os.environ, env), patch(
+            "%s.known_keys_cache" % MODULE, known_keys
+        ):
+            fname = model.create(
+                {"name": "a", "datas": base64.b64encode(self.content)}
+            ).store_fname
+            # deleted by the garbage collector of another worker
+            del self.fake_store[fname]
+            model.create({"name": "b", "datas": base64.b64encode(self.content)})
+            self.assertNotIn(fname, self.fake_store)
+            self.assertEqual(known_keys.stats()["skipped"], 1)
+            model._increment_gc_generation()
+            model.create({"name": "c", "datas": base64.b64encode(self.content)})
+            self.assertEqual(self.fake_store[fname], self.content)
@@ -0,0 +1,91 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import base64
+import os
+from contextlib import closing
+from unittest.mock import patch
+
+from odoo import api
+from odoo.sql_db import db_connect
+from odoo.tests import TransactionCase
+
+from .common import FakeStoreMixin
+
+
+class TestDelete(FakeStoreMixin, TransactionCase):
+    def _create(self, content, count=1):
+        return self.env["ir.attachment"].create(
+            [
+                {"name": "a%d" % index, "datas": base64.b64encode(content)}
+                for index in range(count)
+            ]
+        )
+
+    def test_unlink_shared_file(self):
+        """A file is deleted with the last attachment referencing it"""
+        attachments = self._create(os.urandom(60 * 1024), count=2)
+        fname = attachments[0].store_fname
+        attachments[0].unlink()
+        self.assertIn(fname, self.fake_store)
+        attachments[1].unlink()
+        self.assertNotIn(fname, self.fake_store)
+        self.assertEqual(self.fake_store_deleted, [fname])
+
+    def test_unlink_batch(self):
+        """The references of the files are checked once for the batch"""
+        shared = self._create(os.urandom(60 * 1024), count=2)
+        others = self._create(os.urandom(60 * 1024)) | self._create(
+            os.urandom(60 * 1024)
+        )
+        kept_fname = shared[1].store_fname
+        deleted_fnames = others.mapped("store_fname")
+        model_class = type(self.env["ir.attachment"])
+        with patch.object(
+            model_class,
+            "_get_used_fnames",
+            autospec=True,
+            side_effect=model_class._get_used_fnames,
+        ) as get_used_fnames:
+            (shared[0] | others).unlink()
+        get_used_fnames.assert_called_once()
+        self.assertIn(kept_fname, self.fake_store)
+        self.assertEqual(sorted(self.fake_store_deleted), sorted(deleted_fnames))
+
+    def _queued_fnames(self):
+        self.env.cr.execute("SELECT store_fname FROM ir_attachment_store_gc")
+        return {row[0] for row in self.env.cr.fetchall()}
+
+    def test_deferred_gc(self):
+        """The queued files are deleted by the garbage collector unless they
+        are referenced again"""
+        shared = self._create(os.urandom(60 * 1024), count=2)
+        unused = self._create(os.urandom(60 * 1024))
+        shared_fname = shared[0].store_fname
+        unused_fname = unused.store_fname
+        with patch.dict(os.environ, {"ATTACHMENT_STORAGE_DEFERRED_GC": "1"}):
+            (shared[0] | unused).unlink()
+        self.assertEqual(self._queued_fnames(), {shared_fname, unused_fname})
+        self.assertEqual(self.fake_store_deleted, [])
+        # the garbage collector commits after each chunk
+        with patch.object(self.env.cr, "commit"):
+            self.env["ir.attachment"]._gc_object_storage()
+        self.assertIn(shared_fname, self.fake_store)
+        self.assertNotIn(unused_fname, self.fake_store)
+        self.assertEqual(self.fake_store_deleted, [unused_fname])
+        self.assertEqual(self._queued_fnames(), set())
+
+    def test_deferred_gc_file_being_written(self):
+        """A file locked by a transaction writing it stays queued"""
+        attachment = self._create(os.urandom(60 * 1024))
+        fname = attachment.store_fname
+        checksum = attachment.checksum
+        with patch.dict(os.environ, {"ATTACHMENT_STORAGE_DEFERRED_GC": "1"}):
+            attachment.unlink()
+            with closing(db_connect(self.env.cr.dbname).cursor()) as cr:
+                env = api.Environment(cr, self.env.uid, {})
+                env["ir.attachment"]._lock_store_keys([checksum])
+                with patch.object(self.env.cr, "commit"):
+                    self.env["ir.attachment"]._gc_object_storage()
+        self.assertIn(fname, self.fake_store)
+        self.assertEqual(self._queued_fnames(), {fname})
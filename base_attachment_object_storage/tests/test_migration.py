@@ -0,0 +1,56 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import base64
+import os
+
+from odoo.tests import TransactionCase
+
+from .common import FakeStoreMixin
+
+
+class TestMigration(FakeStoreMixin, TransactionCase):
+    def _create_in_filestore(self, content, count=1):
+        config = self.env["ir.config_parameter"].sudo()
+        config.set_param("ir_attachment.location", "file")
+        attachments = self.env["ir.attachment"].create(
+            [
+                {"name": "a%d" % index, "datas": base64.b64encode(content)}
+                for index in range(count)
+            ]
+        )
+        config.set_param("ir_attachment.location", "fake")
+        return attachments
+
+    def test_shared_checksum(self):
+        """The content shared by several attachments is sent once"""
+        content = os.urandom(60 * 1024)
+        attachments = self._create_in_filestore(content, count=3)
+        old_fname = attachments[0].store_fname
+        self.assertEqual(set(attachments.mapped("store_fname")), {old_fname})
+        checksum = attachments[0].checksum
+        files_to_clean = attachments._move_attachments_to_store()
+        fname = "fake://bucket/%s" % (checksum,)
+        self.assertEqual(list(self.fake_store), [fname])
+        self.assertEqual(set(attachments.mapped("store_fname")), {fname})
+        self.assertEqual(files_to_clean, [attachments._full_path(old_fname)])
+        for attachment in attachments:
+            self.assertEqual(attachment.raw, content)
+
+    def test_checksum_mismatch(self):
+        """An attachment whose content does not match its checksum is
+        written with the ORM, keyed by the checksum of its content"""
+        content = os.urandom(60 * 1024)
+        attachment = self._create_in_filestore(content)
+        checksum = attachment.checksum
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET checksum = %s WHERE id = %s",
+            ("0" * 40, attachment.id),
+        )
+        attachment.invalidate_recordset()
+        attachment._move_attachments_to_store()
+        fname = "fake://bucket/%s" % (checksum,)
+        self.assertEqual(list(self.fake_store), [fname])
+        self.assertEqual(attachment.store_fname, fname)
+        self.assertEqual(attachment.checksum, checksum)
+        self.assertEqual(attachment.raw, content)
@@ -0,0 +1,54 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import base64
+import io
+import os
+
+from PIL import Image
+
+from odoo.tests import HttpCase, tagged
+
+from .common import FakeStoreMixin
+
+
+@tagged("post_install", "-at_install")
+class TestStream(FakeStoreMixin, HttpCase):
+    def _create_image(self):
+        # random pixels do not compress: the image is above the 50KB stored
+        # in the database by default
+        image = Image.frombytes("RGB", (200, 200), os.urandom(200 * 200 * 3))
+        content = io.BytesIO()
+        image.save(content, format="PNG")
+        data = content.getvalue()
+        self.assertGreater(len(data), 50 * 1024)
+        attachment = self.env["ir.attachment"].create(
+            {"name": "image.png", "datas": base64.b64encode(data)}
+        )
+        self.assertTrue(attachment.store_fname.startswith("fake://"))
+        return attachment, data
+
+    def test_download_streamed(self):
+        attachment, data = self._create_image()
+        self.authenticate("admin", "admin")
+        response = self.url_open("/web/content/%d" % attachment.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, data)
+
+    def test_download_range(self):
+        attachment, data = self._create_image()
+        self.authenticate("admin", "admin")
+        response = self.url_open(
+            "/web/content/%d" % attachment.id, headers={"Range": "bytes=100-199"}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, data[100:200])
+
+    def test_image_resized(self):
+        """The content of a streamed file is loaded to be processed"""
+        attachment, __ = self._create_image()
+        self.authenticate("admin", "admin")
+        response = self.url_open("/web/image/%d?width=64" % attachment.id)
+        self.assertEqual(response.status_code, 200)
+        image = Image.open(io.BytesIO(response.content))
+        self.assertEqual(image.size, (64, 64))
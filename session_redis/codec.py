@@ -0,0 +1,278 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import json
+import logging
+import zlib
+from datetime import date, datetime
+
+from . import json_encoding
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # noqa
+    _logger.debug("Cannot 'import msgpack'.")
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None  # noqa
+    _logger.debug("Cannot 'import lz4'.")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # noqa
+    _logger.debug("Cannot 'import zstandard'.")
+
+
+class SessionCodec(object):
+    """Serialize the content of the sessions stored in Redis
+
+    The payload written by a codec starts with its ``version`` byte, so the
+    sessions written by any codec can be read whatever the codec currently
+    configured. The sessions written before the codecs existed are plain
+    JSON documents, they start with ``{`` and are read by ``LegacyCodec``.
+    """
+
+    version = None
+
+    def encode(self, data):
+        raise NotImplementedError()
+
+    def decode(self, payload):
+        raise NotImplementedError()
+
+
+class LegacyCodec(SessionCodec):
+    """JSON documents using ``json_encoding``, without version byte"""
+
+    def encode(self, data):
+        return json.dumps(data, cls=json_encoding.SessionEncoder).encode("utf-8")
+
+    def decode(self, payload):
+        return json.loads(payload.decode("utf-8"), cls=json_encoding.SessionDecoder)
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return {"_type": "datetime_isoformat", "value": obj.isoformat()}
+    elif isinstance(obj, date):
+        return {"_type": "date_isoformat", "value": obj.isoformat()}
+    elif isinstance(obj, set):
+        return {"_type": "set", "value": tuple(obj)}
+    raise TypeError(
+        "Object of type %s is not JSON serializable" % (obj.__class__.__name__,)
+    )
+
+
+def _json_object_hook(obj):
+    type_ = obj.get("_type")
+    if type_ is None:
+        return obj
+    if type_ == "datetime_isoformat":
+        return datetime.fromisoformat(obj["value"])
+    elif type_ == "date_isoformat":
+        return date.fromisoformat(obj["value"])
+    elif type_ == "set":
+        return set(obj["value"])
+    return obj
+
+
+class JsonCodec(SessionCodec):
+    """Compact JSON, the dates being parsed with ``fromisoformat``"""
+
+    version = b"\x01"
+
+    def encode(self, data):
+        return self.version + json.dumps(
+            data, default=_json_default, separators=(",", ":")
+        ).encode("utf-8")
+
+    def decode(self, payload):
+        document = payload[1:].decode("utf-8")
+        # most sessions have no date nor set, the hook is then not needed
+        # on each object
+        if '"_type"' not in document:
+            return json.loads(document)
+        return json.loads(document, object_hook=_json_object_hook)
+
+
+MSGPACK_EXT_DATETIME = 1
+MSGPACK_EXT_DATE = 2
+MSGPACK_EXT_SET = 3
+
+
+class MsgpackCodec(SessionCodec):
+    """MessagePack, with extension types for date, datetime and set"""
+
+    version = b"\x02"
+
+    def _default(self, obj):
+        if isinstance(obj, datetime):
+            return msgpack.ExtType(
+                MSGPACK_EXT_DATETIME, obj.isoformat().encode("ascii")
+            )
+        elif isinstance(obj, date):
+            return msgpack.ExtType(MSGPACK_EXT_DATE, obj.isoformat().encode("ascii"))
+        elif isinstance(obj, set):
+            return msgpack.ExtType(MSGPACK_EXT_SET, self._pack(list(obj)))
+        raise TypeError(
+            "Object of type %s is not serializable" % (obj.__class__.__name__,)
+        )
+
+    def _ext_hook(self, code, data):
+        if code == MSGPACK_EXT_DATETIME:
+            return datetime.fromisoformat(data.decode("ascii"))
+        elif code == MSGPACK_EXT_DATE:
+            return date.fromisoformat(data.decode("ascii"))
+        elif code == MSGPACK_EXT_SET:
+            return set(self._unpack(data))
+        return msgpack.ExtType(code, data)
+
+    def _pack(self, data):
+        return msgpack.packb(data, default=self._default, use_bin_type=True)
+
+    def _unpack(self, data):
+        return msgpack.unpackb(
+            data, ext_hook=self._ext_hook, raw=False, strict_map_key=False
+        )
+
+    def encode(self, data):
+        return self.version + self._pack(data)
+
+    def decode(self, payload):
+        return self._unpack(payload[1:])
+
+
+CODECS = {
+    "legacy": LegacyCodec,
+    "json": JsonCodec,
+    "msgpack": MsgpackCodec,
+}
+
+CODEC_VERSIONS = {
+    codec_class.version: codec_class
+    for codec_class in CODECS.values()
+    if codec_class.version
+}
+
+
+def get_codec(name):
+    """Return the codec used to write the sessions"""
+    name = name or "legacy"
+    if name not in CODECS:
+        raise Exception("Unknown session codec '%s'" % (name,))
+    if name == "msgpack" and msgpack is None:
+        _logger.warning("msgpack is not installed, the sessions are stored in JSON")
+        name = "json"
+    return CODECS[name]()
+
+
+def decode(payload):
+    """Read a session written by any codec"""
+    codec_class = CODEC_VERSIONS.get(payload[:1], LegacyCodec)
+    if codec_class is MsgpackCodec and msgpack is None:
+        raise ValueError("msgpack is not installed")
+    return codec_class().decode(payload)
+
+
+class SessionCompressor(object):
+    """Compress the payloads of the sessions stored in Redis
+
+    A compressed payload starts with the ``header`` byte of its compressor,
+    distinct from the version bytes of the codecs, so the compressed and
+    uncompressed sessions can be read whatever the configuration.
+    """
+
+    header = None
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def compress(self, payload):
+        raise NotImplementedError()
+
+    def decompress(self, payload):
+        raise NotImplementedError()
+
+
+class ZlibCompressor(SessionCompressor):
+    header = b"\x10"
+
+    def compress(self, payload):
+        return self.header + zlib.compress(payload, 1)
+
+    def decompress(self, payload):
+        return zlib.decompress(payload[1:])
+
+
+class Lz4Compressor(SessionCompressor):
+    header = b"\x11"
+
+    @classmethod
+    def is_available(cls):
+        return lz4 is not None
+
+    def compress(self, payload):
+        return self.header + lz4.frame.compress(payload)
+
+    def decompress(self, payload):
+        return lz4.frame.decompress(payload[1:])
+
+
+class ZstdCompressor(SessionCompressor):
+    header = b"\x12"
+
+    @classmethod
+    def is_available(cls):
+        return zstandard is not None
+
+    def compress(self, payload):
+        return self.header + zstandard.ZstdCompressor().compress(payload)
+
+    def decompress(self, payload):
+        return zstandard.ZstdDecompressor().decompress(payload[1:])
+
+
+COMPRESSORS = {
+    "zlib": ZlibCompressor,
+    "lz4": Lz4Compressor,
+    "zstd": ZstdCompressor,
+}
+
+COMPRESSOR_HEADERS = {
+    compressor_class.header: compressor_class
+    for compressor_class in COMPRESSORS.values()
+}
+
+
+def get_compressor(name):
+    """Return the compressor used to write the sessions, if any"""
+    if not name:
+        return None
+    if name not in COMPRESSORS:
+        raise Exception("Unknown session compression '%s'" % (name,))
+    if not COMPRESSORS[name].is_available():
+        _logger.warning(
+            "%s is not installed, the sessions are compressed with zlib", name
+        )
+        name = "zlib"
+    return COMPRESSORS[name]()
+
+
+def decompress(payload):
+    """Return the payload of a session, decompressed if needed"""
+    compressor_class = COMPRESSOR_HEADERS.get(payload[:1])
+    if compressor_class is None:
+        return payload
+    if not compressor_class.is_available():
+        raise ValueError("The session is compressed with an unavailable library")
+    try:
+        return compressor_class().decompress(payload)
+    except Exception as error:
+        raise ValueError("The session could not be decompressed") from error
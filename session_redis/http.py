@@ -8,6 +8,7 @@ from odoo import http
 from odoo.tools import config
 from odoo.tools.func import lazy_property
 
+from .codec import get_codec, get_compressor
 from .session import RedisSessionStore
 from .strtobool import strtobool
 
@@ -40,6 +41,15 @@ url = os.environ.get("ODOO_SESSION_REDIS_URL")
 password = os.environ.get("ODOO_SESSION_REDIS_PASSWORD")
 expiration = os.environ.get("ODOO_SESSION_REDIS_EXPIRATION")
 anon_expiration = os.environ.get("ODOO_SESSION_REDIS_EXPIRATION_ANONYMOUS")
+codec = os.environ.get("ODOO_SESSION_REDIS_CODEC")
+compression = os.environ.get("ODOO_SESSION_REDIS_COMPRESSION")
+compression_threshold = int(
+    os.environ.get("ODOO_SESSION_REDIS_COMPRESSION_THRESHOLD", 4096)
+)
+scan_count = int(os.environ.get("ODOO_SESSION_REDIS_SCAN_COUNT", 1000))
+expiration_granularity = int(
+    os.environ.get("ODOO_SESSION_REDIS_EXPIRATION_GRANULARITY", 0)
+)
 
 
 @lazy_property
@@ -56,6 +66,11 @@ def session_store(self):
         prefix=prefix,
         expiration=expiration,
         anon_expiration=anon_expiration,
+        expiration_granularity=expiration_granularity,
+        codec=get_codec(codec),
+        compressor=get_compressor(compression),
+        compression_threshold=compression_threshold,
+        scan_count=scan_count,
         session_class=http.Session,
     )
 
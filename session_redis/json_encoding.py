@@ -4,8 +4,6 @@
 import json
 from datetime import date, datetime
 
-import dateutil
-
 
 class SessionEncoder(json.JSONEncoder):
     """Encode date/datetime objects
@@ -34,9 +32,9 @@ class SessionDecoder(json.JSONDecoder):
             return obj
         type_ = obj["_type"]
         if type_ == "datetime_isoformat":
-            return dateutil.parser.parse(obj["value"])
+            return datetime.fromisoformat(obj["value"])
         elif type_ == "date_isoformat":
-            return dateutil.parser.parse(obj["value"]).date()
+            return date.fromisoformat(obj["value"])
         elif type_ == "set":
             return set(obj["value"])
         return obj
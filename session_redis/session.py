@@ -1,18 +1,26 @@
 # Copyright 2016-2019 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
-import json
+import hashlib
 import logging
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
 
 from odoo.service import security
 from odoo.tools._vendor.sessions import SessionStore
 
-from . import json_encoding
+from . import codec as session_codec
 
 # this is equal to the duration of the session garbage collector in
 # odoo.http.session_gc()
 DEFAULT_SESSION_TIMEOUT = 60 * 60 * 24 * 7  # 7 days in seconds
 DEFAULT_SESSION_TIMEOUT_ANONYMOUS = 60 * 60 * 3  # 3 hours in seconds
+# number of sessions whose payload is remembered by a worker
+SESSION_DIGESTS_SIZE = 10000
+# number of keys asked to redis by each SCAN command
+DEFAULT_SCAN_COUNT = 1000
 
 _logger = logging.getLogger(__name__)
 
@@ -27,6 +35,11 @@ class RedisSessionStore(SessionStore):
         prefix="",
         expiration=None,
         anon_expiration=None,
+        expiration_granularity=None,
+        codec=None,
+        compressor=None,
+        compression_threshold=None,
+        scan_count=None,
     ):
         super().__init__(session_class=session_class)
         self.redis = redis
@@ -41,6 +54,90 @@ class RedisSessionStore(SessionStore):
         self.prefix = "session:"
         if prefix:
             self.prefix = "%s:%s:" % (self.prefix, prefix)
+        # delay in seconds during which the expiration of an unmodified
+        # session is not refreshed
+        self.expiration_granularity = expiration_granularity or 0
+        # codec used to write the sessions, they are read whatever the codec
+        # which wrote them
+        self.codec = codec or session_codec.get_codec(None)
+        # the payloads larger than the threshold (in bytes) are compressed
+        self.compressor = compressor
+        self.compression_threshold = compression_threshold or 0
+        self.scan_count = scan_count or DEFAULT_SCAN_COUNT
+        self._stats_lock = threading.Lock()
+        self._compression_stats = {
+            "compressed": 0,
+            "incompressible": 0,
+            "size": 0,
+            "compressed_size": 0,
+            "compression_time": 0.0,
+            "decompressed": 0,
+            "decompression_time": 0.0,
+        }
+        self._digests_lock = threading.Lock()
+        # {sid: (digest of the payload in redis, time of the last refresh)}
+        self._digests = OrderedDict()
+
+    def _get_digest(self, sid):
+        with self._digests_lock:
+            return self._digests.get(sid, (None, None))
+
+    def _set_digest(self, sid, digest, refreshed_at=None):
+        with self._digests_lock:
+            self._digests.pop(sid, None)
+            self._digests[sid] = (digest, refreshed_at)
+            while len(self._digests) > SESSION_DIGESTS_SIZE:
+                self._digests.popitem(last=False)
+
+    def _forget_digest(self, sid):
+        with self._digests_lock:
+            self._digests.pop(sid, None)
+
+    def _add_stats(self, **values):
+        with self._stats_lock:
+            for name, value in values.items():
+                self._compression_stats[name] += value
+
+    def compression_stats(self):
+        """Return the metrics of the compression of the sessions of the worker
+
+        The ratio is the size of the compressed payloads divided by their
+        size before compression, the times are the total CPU time spent in
+        seconds. The payloads which are not smaller once compressed are
+        stored uncompressed, they are counted as ``incompressible``.
+        """
+        with self._stats_lock:
+            stats = dict(self._compression_stats)
+        stats["ratio"] = (
+            stats["compressed_size"] / stats["size"] if stats["size"] else None
+        )
+        return stats
+
+    def _compress(self, data):
+        if not self.compressor or len(data) <= self.compression_threshold:
+            return data
+        start = time.thread_time()
+        compressed = self.compressor.compress(data)
+        compression_time = time.thread_time() - start
+        if len(compressed) >= len(data):
+            # not worth it, the payload is kept as is
+            self._add_stats(incompressible=1, compression_time=compression_time)
+            return data
+        self._add_stats(
+            compressed=1,
+            size=len(data),
+            compressed_size=len(compressed),
+            compression_time=compression_time,
+        )
+        return compressed
+
+    def _decompress(self, saved):
+        if saved[:1] not in session_codec.COMPRESSOR_HEADERS:
+            return saved
+        start = time.thread_time()
+        payload = session_codec.decompress(saved)
+        self._add_stats(decompressed=1, decompression_time=time.thread_time() - start)
+        return payload
 
     def build_key(self, sid):
         return "%s%s" % (self.prefix, sid)
@@ -66,15 +163,30 @@ class RedisSessionStore(SessionStore):
                 user_msg,
             )
 
-        data = json.dumps(dict(session), cls=json_encoding.SessionEncoder).encode(
-            "utf-8"
-        )
-        if self.redis.set(key, data):
-            return self.redis.expire(key, expiration)
+        data = self.codec.encode(dict(session))
+        digest = hashlib.sha1(data).digest()
+        previous_digest, refreshed_at = self._get_digest(session.sid)
+        now = time.time()
+        if digest == previous_digest:
+            # the session in redis is the same, only its expiration is
+            # refreshed, at most once per granularity
+            if (
+                refreshed_at is not None
+                and now - refreshed_at < self.expiration_granularity
+            ):
+                return True
+            self._set_digest(session.sid, digest, now)
+            if self.redis.expire(key, expiration):
+                return True
+            # the key has been deleted in the meantime
+        self._set_digest(session.sid, digest, now)
+        # the value and its expiration are set atomically, in one round trip
+        return self.redis.set(key, self._compress(data), ex=expiration)
 
     def delete(self, session):
         key = self.build_key(session.sid)
         _logger.debug("deleting session with key %s", key)
+        self._forget_digest(session.sid)
         return self.redis.delete(key)
 
     def get(self, sid):
@@ -95,20 +207,127 @@ class RedisSessionStore(SessionStore):
             )
             return self.new()
         try:
-            data = json.loads(saved.decode("utf-8"), cls=json_encoding.SessionDecoder)
+            payload = self._decompress(saved)
+            data = session_codec.decode(payload)
         except ValueError:
             _logger.debug(
-                "session for key '%s' has been asked but its json "
+                "session for key '%s' has been asked but its "
                 "content could not be read, it has been reset",
                 key,
             )
             data = {}
+        else:
+            # the session is not written again if it is saved unmodified,
+            # nor its expiration refreshed before the granularity elapsed
+            digest = hashlib.sha1(payload).digest()
+            previous_digest, refreshed_at = self._get_digest(sid)
+            if digest != previous_digest:
+                refreshed_at = None
+            self._set_digest(sid, digest, refreshed_at)
         return self.session_class(data, sid, False)
 
+    def _scan_keys(self, pattern, count=None):
+        """Iterate on the keys matching the pattern with SCAN
+
+        Unlike KEYS, SCAN does not block the redis server while the whole
+        keyspace is read, the keys are returned by batches of ``count``.
+        A key can be returned twice.
+        """
+        return self.redis.scan_iter(match=pattern, count=count or self.scan_count)
+
+    def _prefix_pattern(self):
+        # the prefix must not be interpreted as a glob-style pattern
+        return "%s*" % re.sub(r"([\\*?\[\]])", r"\\\1", self.prefix)
+
+    def _get_sid(self, key):
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        return key[len(self.prefix) :]
+
+    def _scan_session_keys(self, count=None):
+        """Iterate on the keys of the sessions of the store
+
+        The keys of the stores with a prefix (``session::<prefix>:<sid>``)
+        also match the pattern of the store without prefix (``session:*``),
+        they are skipped: a session id never contains ``:``.
+        """
+        for key in self._scan_keys(self._prefix_pattern(), count=count):
+            if ":" not in self._get_sid(key):
+                yield key
+
+    def iter_sids(self, count=None):
+        """Iterate on the ids of the sessions of the store"""
+        for key in self._scan_session_keys(count=count):
+            yield self._get_sid(key)
+
     def list(self):
-        keys = self.redis.keys("%s*" % self.prefix)
         _logger.debug("a listing redis keys has been called")
-        return [key[len(self.prefix) :] for key in keys]
+        return list(self.iter_sids())
+
+    def iter_sessions(self, count=None):
+        """Iterate on the ids and the content of the sessions of the store
+
+        The sessions are read by batches of ``count`` with MGET. The
+        sessions which expire or can't be read are skipped.
+        """
+        count = count or self.scan_count
+        keys = []
+        for key in self._scan_session_keys(count=count):
+            keys.append(key)
+            if len(keys) >= count:
+                yield from self._read_sessions(keys)
+                keys = []
+        if keys:
+            yield from self._read_sessions(keys)
+
+    def _read_sessions(self, keys):
+        for key, saved in zip(keys, self.redis.mget(keys)):
+            if not saved:
+                continue
+            try:
+                data = session_codec.decode(self._decompress(saved))
+            except ValueError:
+                continue
+            yield self._get_sid(key), data
+
+    def purge_user_sessions(self, uid, count=None):
+        """Delete all the sessions of a user, return the number of sessions
+
+        Can be used to log out a user from all their devices, for instance
+        from an odoo shell with
+        ``odoo.http.root.session_store.purge_user_sessions(uid)``.
+        """
+        count = count or self.scan_count
+        # SCAN can return a key twice
+        sids = list(
+            {
+                sid: True
+                for sid, data in self.iter_sessions(count)
+                if data.get("uid") == uid
+            }
+        )
+        for index in range(0, len(sids), count):
+            chunk = sids[index : index + count]
+            self.redis.delete(*(self.build_key(sid) for sid in chunk))
+        for sid in sids:
+            self._forget_digest(sid)
+        _logger.info("%d sessions of the user %s deleted", len(sids), uid)
+        return len(sids)
+
+    def count_sessions(self, count=None):
+        """Count the sessions of redis by prefix
+
+        All the sessions of the redis database are counted, whatever their
+        prefix, so a redis server shared by several databases can be
+        inspected. Return a ``Counter`` of the number of sessions by key
+        prefix (e.g. ``session::<prefix>``).
+        """
+        counter = Counter()
+        for key in self._scan_keys("session:*", count=count):
+            if isinstance(key, bytes):
+                key = key.decode("utf-8", "replace")
+            counter[key.rpartition(":")[0]] += 1
+        return counter
 
     def rotate(self, session, env):
         self.delete(session)
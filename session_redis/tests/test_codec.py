@@ -0,0 +1,62 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+from datetime import date, datetime
+
+from odoo.tests.common import BaseCase
+
+from odoo.addons.session_redis import codec
+
+
+class TestCodec(BaseCase):
+    def _session_data(self):
+        return {
+            "uid": 2,
+            "login": "admin",
+            "context": {"lang": "fr_FR", "tz": "Europe/Zurich"},
+            "deadline": datetime(2026, 1, 2, 3, 4, 5, 6),
+            "day": date(2026, 1, 2),
+            "groups": {"base.group_user", "base.group_system"},
+            "nested": [{"_type": "unknown", "value": 1}, "été", None, 1.5],
+        }
+
+    def test_default_codec(self):
+        self.assertIsInstance(codec.get_codec(None), codec.LegacyCodec)
+        with self.assertRaisesRegex(Exception, "Unknown session codec"):
+            codec.get_codec("unknown")
+
+    def test_codecs_round_trip(self):
+        data = self._session_data()
+        for name in codec.CODECS:
+            if name == "msgpack" and codec.msgpack is None:
+                continue
+            with self.subTest(codec=name):
+                session_codec = codec.get_codec(name)
+                payload = session_codec.encode(data)
+                self.assertEqual(session_codec.decode(payload), data)
+                self.assertEqual(codec.decode(payload), data)
+
+    def test_json_codec_without_types(self):
+        data = {"uid": 2, "context": {"lang": "en_US"}}
+        payload = codec.JsonCodec().encode(data)
+        self.assertEqual(codec.decode(payload), data)
+
+    def test_legacy_payload(self):
+        payload = (
+            b'{"uid": 2, "day": {"_type": "date_isoformat", "value": "2026-01-02"}}'
+        )
+        self.assertEqual(codec.decode(payload), {"uid": 2, "day": date(2026, 1, 2)})
+
+    def test_compressors_round_trip(self):
+        payload = codec.JsonCodec().encode(self._session_data()) * 100
+        for name, compressor_class in codec.COMPRESSORS.items():
+            if not compressor_class.is_available():
+                continue
+            with self.subTest(compressor=name):
+                compressed = codec.get_compressor(name).compress(payload)
+                self.assertLess(len(compressed), len(payload))
+                self.assertEqual(codec.decompress(compressed), payload)
+
+    def test_decompress_uncompressed(self):
+        payload = codec.LegacyCodec().encode(self._session_data())
+        self.assertEqual(codec.decompress(payload), payload)
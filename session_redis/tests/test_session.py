@@ -0,0 +1,52 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import os
+from unittest.mock import MagicMock
+
+from odoo.tests.common import BaseCase
+
+from odoo.addons.session_redis import codec
+from odoo.addons.session_redis.session import RedisSessionStore
+
+
+class TestSession(BaseCase):
+    def _store(self, **kwargs):
+        return RedisSessionStore(MagicMock(), **kwargs)
+
+    def test_compress(self):
+        store = self._store(compressor=codec.ZlibCompressor(), compression_threshold=8)
+        payload = b"{" + b"0" * 100 + b"}"
+        compressed = store._compress(payload)
+        self.assertEqual(compressed[:1], codec.ZlibCompressor.header)
+        self.assertEqual(store._decompress(compressed), payload)
+        self.assertEqual(store.compression_stats()["compressed"], 1)
+
+    def test_compress_incompressible(self):
+        """A payload larger once compressed is stored as is"""
+        store = self._store(compressor=codec.ZlibCompressor(), compression_threshold=8)
+        payload = b"\x01" + os.urandom(100)
+        self.assertEqual(store._compress(payload), payload)
+        stats = store.compression_stats()
+        self.assertEqual(stats["compressed"], 0)
+        self.assertEqual(stats["incompressible"], 1)
+        self.assertIsNone(stats["ratio"])
+
+    def test_unprefixed_store_skips_prefixed_sessions(self):
+        """The sessions of the prefixed stores sharing the redis server are
+        not listed nor purged by the store without prefix"""
+        store = self._store()
+        payload = codec.LegacyCodec().encode({"uid": 2})
+        keys = [b"session:abc", b"session::p[1]:def"]
+        store.redis.scan_iter.return_value = keys
+        store.redis.mget.side_effect = lambda keys: [payload] * len(keys)
+        self.assertEqual(store.list(), ["abc"])
+        self.assertEqual(store.purge_user_sessions(2), 1)
+        store.redis.delete.assert_called_once_with("session:abc")
+
+    def test_prefixed_store(self):
+        store = self._store(prefix="p[1]")
+        store.redis.scan_iter.return_value = [b"session::p[1]:def"]
+        self.assertEqual(store.list(), ["def"])
+        __, kwargs = store.redis.scan_iter.call_args
+        self.assertEqual(kwargs["match"], r"session::p\[1\]:*")